@@ -0,0 +1,175 @@
+import hashlib
+import os
+
+import numpy as np
+
+import notearray
+
+# The version of pitch detection and of the entry format. Increase it whenever either changes, so older entries are not used.
+VERSION = 2
+# The number of bytes in each block of a file that is hashed.
+HASH_BLOCK_SIZE = 64 * 1024
+# The number of evenly spaced blocks of a file that are hashed, including the first and last. Smaller files are hashed whole.
+HASH_BLOCK_COUNT = 16
+
+class AnalysisCache:
+    """
+    A cache of pitch detection results on disk, addressed by the identity, modification time and sampled contents of the audio file
+    and the detection parameters.
+
+    Each entry is an .npz file with the raw pitch track of each channel, before post-processing. Notes are derived from it
+    again whenever it is loaded, so post-processing can change without invalidating the cache.
+    The least recently used entries are deleted when the cache grows past its size limit.
+    """
+
+    def __init__(self, directory, maxBytes):
+        """
+        Initializes an analysis cache.
+
+        Args:
+            directory: The directory to keep entries in. It is created when the first entry is saved.
+            maxBytes: The maximum number of bytes of entries to keep.
+        """
+        self.directory = directory
+        self.maxBytes = maxBytes
+
+    def getKey(self, filePath, parameters, progress = None):
+        """
+        Gets the key of the analysis of an audio file.
+
+        Only a few evenly spaced blocks of the file are hashed, so the key of a large file is found without reading all of it.
+        The size, modification time and inode of the file are hashed too, so that an edit between the hashed blocks
+        still changes the key.
+
+        Args:
+            filePath: The file path of the audio file.
+            parameters: The parameters that detection results depend on. Their repr must only change when the parameters do.
+            progress: A function called with the fraction [0,1] of the blocks hashed so far.
+
+        Returns:
+            A hexadecimal key that is the same for the same audio, parameters and version.
+        """
+        contentHash = hashlib.blake2b(digest_size = 16)
+        stat = os.stat(filePath)
+        size = stat.st_size
+        contentHash.update(repr((VERSION, parameters, size, stat.st_mtime_ns, stat.st_ino)).encode())
+        if size <= HASH_BLOCK_SIZE * HASH_BLOCK_COUNT:
+            offsets = range(0, size, HASH_BLOCK_SIZE)
+        else:
+            lastOffset = size - HASH_BLOCK_SIZE
+            offsets = [lastOffset * block // (HASH_BLOCK_COUNT - 1) for block in range(HASH_BLOCK_COUNT)]
+        with open(filePath, "rb") as audioFile:
+            for i, offset in enumerate(offsets):
+                if progress:
+                    progress(i / len(offsets))
+                audioFile.seek(offset)
+                contentHash.update(audioFile.read(HASH_BLOCK_SIZE))
+        return contentHash.hexdigest()
+
+    def getPath(self, key):
+        """
+        Gets the file path of an entry.
+
+        Args:
+            key: The key of the entry.
+
+        Returns:
+            The file path of the entry.
+        """
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, key):
+        """
+        Loads an entry, marking it as the most recently used.
+
+        Args:
+            key: The key of the entry.
+
+        Returns:
+            A list with the raw pitch track of each channel, or None if there is no usable entry. Each raw pitch track is
+            a tuple of the detected notes as a NoteArray, the peak sample magnitude of each note and the peak sample magnitude of the channel.
+        """
+        path = self.getPath(key)
+        try:
+            with np.load(path) as entry:
+                if int(entry["version"]) != VERSION:
+                    return None
+                rawTracks = []
+                for channel in range(int(entry["channels"])):
+                    prefix = "channel" + str(channel) + "_"
+                    rawNotes = notearray.NoteArray(entry[prefix + "rawMidi"], entry[prefix + "rawDuration"], entry[prefix + "rawVolume"])
+                    rawTracks.append((rawNotes, entry[prefix + "rawPeaks"], np.float32(entry[prefix + "peak"])))
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Entries that cannot be read are discarded.
+            self.remove(path)
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return rawTracks
+
+    def save(self, key, rawTracks):
+        """
+        Saves an entry, evicting the least recently used entries if the cache is too large.
+
+        Args:
+            key: The key of the entry.
+            rawTracks: The raw pitch track of each channel, as returned by load.
+        """
+        arrays = {"version": np.int64(VERSION), "channels": np.int64(len(rawTracks))}
+        for channel, (rawNotes, rawPeaks, peak) in enumerate(rawTracks):
+            prefix = "channel" + str(channel) + "_"
+            arrays[prefix + "rawMidi"] = rawNotes.midi
+            arrays[prefix + "rawDuration"] = rawNotes.duration
+            arrays[prefix + "rawVolume"] = rawNotes.volume
+            arrays[prefix + "rawPeaks"] = np.asarray(rawPeaks, dtype = np.float32)
+            arrays[prefix + "peak"] = np.float32(peak)
+
+        os.makedirs(self.directory, exist_ok = True)
+        # Entries are written under a temporary name first, so other processes never read a partial entry.
+        path = self.getPath(key)
+        temporaryPath = path + "." + str(os.getpid()) + ".tmp"
+        with open(temporaryPath, "wb") as entryFile:
+            np.savez_compressed(entryFile, **arrays)
+        os.replace(temporaryPath, path)
+        self.evict()
+
+    def evict(self):
+        """Deletes the least recently used entries until the cache fits in its size limit."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                try:
+                    status = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, entry.path))
+        entries.sort()
+        totalBytes = sum(size for modified, size, path in entries)
+        for modified, size, path in entries:
+            if totalBytes <= self.maxBytes:
+                break
+            self.remove(path)
+            totalBytes -= size
+
+    def remove(self, path):
+        """
+        Deletes an entry if it still exists.
+
+        Args:
+            path: The file path of the entry.
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """Deletes every entry."""
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".npz"):
+                    self.remove(entry.path)
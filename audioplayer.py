@@ -1,20 +1,49 @@
+import time
+
 import numpy as np
-import pyaudio as pa
+
+import lazyimport
+
+pa = lazyimport.LazyModule("pyaudio")
+
+# PortAudio callback flags. Their values are fixed by PortAudio, so the playback callback can use them without importing PyAudio.
+CALLBACK_CONTINUE = 0
+CALLBACK_COMPLETE = 1
+OUTPUT_UNDERFLOW = 4
+OUTPUT_OVERFLOW = 8
 
 class AudioPlayer:
     """Plays back audio."""
 
-    def __init__(self, processor):
+    # The number of frames requested by each playback callback.
+    FRAMES_PER_BUFFER = 1024
+    # The histogram of how long playback callbacks take, as a fraction of the time until their buffer is played.
+    CALLBACK_HISTOGRAM = "playCallback duration / deadline"
+    # The upper bounds of the bins of the callback histogram. Callbacks above 1 missed their deadline.
+    CALLBACK_HISTOGRAM_BOUNDS = [0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0]
+
+    def __init__(self, processor, framesPerBuffer = None):
         """
         Initializes the player.
 
         Args:
             processor: The audio processor for the application.
+            framesPerBuffer: The number of frames requested by each playback callback. Defaults to FRAMES_PER_BUFFER.
         """
         self.processor = processor
         self.stream = None
         self.playIndex = 0
-        self.pyaudio = pa.PyAudio()
+        self.framesPerBuffer = framesPerBuffer or AudioPlayer.FRAMES_PER_BUFFER
+        self.channels = 1
+        self.tracks = []
+        self.mixBuffer = None
+        self.trackBuffer = None
+        self.gains = None
+        self.resetStats()
+        self.instrumentation = processor.instrumentation
+        self.instrumentation.addHistogram(AudioPlayer.CALLBACK_HISTOGRAM, AudioPlayer.CALLBACK_HISTOGRAM_BOUNDS)
+        # PyAudio is started when the first stream is opened, so the player can mix without an audio device.
+        self.pyaudio = None
 
     def loadAudioFile(self):
         """
@@ -24,39 +53,141 @@ class AudioPlayer:
         self.channels = self.processor.channels
         self.sampleRate = self.processor.sampleRate
         self.audioLength = self.processor.audioLength
+        self.allocateBuffers(self.framesPerBuffer, len(self.processor.tracks))
         self.loadSamples()
-        self.stream = self.pyaudio.open(format = pa.paFloat32, channels = self.channels, rate = self.sampleRate, output = True, stream_callback = self.playCallback)
+        if self.pyaudio is None:
+            self.pyaudio = pa.PyAudio()
+        self.stream = self.pyaudio.open(format = pa.paFloat32, channels = self.channels, rate = self.sampleRate, output = True, frames_per_buffer = self.framesPerBuffer, stream_callback = self.playCallback)
         self.stream.stop_stream()
 
     def loadSamples(self):
         """
         Loads audio sample data into the player.
         """
-        self.fileTrack = self.processor.fileTrack
-        self.synthesizedTrack = self.processor.synthesizedTrack
+        tracks = list(self.processor.tracks)
+        if self.trackBuffer is None or len(tracks) > len(self.trackBuffer):
+            self.allocateBuffers(self.framesPerBuffer, len(tracks))
+        self.tracks = tracks
+
+    def allocateBuffers(self, frames, trackCount):
+        """
+        Allocates the buffers that tracks are mixed in.
+
+        Args:
+            frames: The number of frames the buffers need to hold.
+            trackCount: The number of tracks the buffers need to hold.
+        """
+        self.mixBuffer = np.zeros((frames, self.channels), dtype = np.float32)
+        # The frames of every active track are stacked so they can be scaled and summed in a single product with the gains.
+        self.trackBuffer = np.zeros((trackCount, frames, self.channels), dtype = np.float32)
+        self.gains = np.zeros(trackCount, dtype = np.float32)
 
     def playCallback(self, inData, frameCount, timeInfo, status):
-        numSamples = frameCount * self.channels
-        if self.playIndex >= self.audioLength:
-            return (np.zeros(numSamples), pa.paComplete)
-        endIndex = self.playIndex + numSamples
-        fileVolume = self.fileTrack.getVolume()
-        synthesizedVolume = self.synthesizedTrack.getVolume()
-        if endIndex >= self.audioLength:
-            fileSamples = self.fileTrack.samples[self.playIndex:]
-            synthesizedSamples = self.synthesizedTrack.samples[self.playIndex:]
+        """
+        Mixes the next frames of the enabled tracks for the output stream.
+
+        Args:
+            inData: The recorded input data, unused for output streams.
+            frameCount: The number of frames to produce.
+            timeInfo: Timing information about the stream.
+            status: PortAudio status flags for underflows and overflows.
+
+        Returns:
+            A tuple of the interleaved float32 frames and whether the stream should continue.
+        """
+        callbackStart = time.perf_counter()
+        if status & OUTPUT_UNDERFLOW:
+            self.underruns += 1
+        if status & OUTPUT_OVERFLOW:
+            self.overruns += 1
+
+        tracks = self.tracks
+        if self.mixBuffer is None or frameCount > len(self.mixBuffer) or len(tracks) > len(self.trackBuffer):
+            self.allocateBuffers(max(frameCount, self.framesPerBuffer), len(tracks))
+        mix = self.mixBuffer[:frameCount]
+
+        remaining = self.audioLength - self.playIndex
+        if remaining <= 0:
+            mix.fill(0)
+            flag = CALLBACK_COMPLETE
         else:
-            fileSamples = self.fileTrack.samples[self.playIndex:endIndex]
-            synthesizedSamples = self.synthesizedTrack.samples[self.playIndex:endIndex]
-        volumeFile = np.multiply(fileSamples, fileVolume)
-        volumeSynthesized = np.multiply(synthesizedSamples, synthesizedVolume)
-        try:
-            samples = volumeFile + volumeSynthesized
-        except ValueError:
-            samples = volumeFile
-        flag = pa.paContinue
-        self.playIndex += frameCount
-        return (samples, flag)
+            self.mixTracks(mix, tracks, min(frameCount, remaining))
+            self.playIndex += frameCount
+            if self.playIndex >= self.audioLength:
+                flag = CALLBACK_COMPLETE
+            else:
+                flag = CALLBACK_CONTINUE
+
+        self.recordCallbackTime(time.perf_counter() - callbackStart, frameCount)
+        return (mix, flag)
+
+    def mixTracks(self, mix, tracks, frameCount):
+        """
+        Mixes the frames of the active tracks at the play position, scaled by each track's volume.
+
+        Frames past the end of a track are treated as silence.
+
+        Args:
+            mix: The buffer of frames to write the mix to.
+            tracks: The tracks to mix.
+            frameCount: The number of frames to mix. Any further frames in the mix are silent.
+        """
+        activeTracks = 0
+        for track in tracks:
+            volume = track.getVolume()
+            if track.samples is None or volume == 0:
+                continue
+            frames = max(min(frameCount, len(track.samples) - self.playIndex), 0)
+            block = self.trackBuffer[activeTracks, :len(mix)]
+            if frames > 0:
+                block[:frames] = track.samples[self.playIndex:self.playIndex + frames].reshape(frames, -1)
+            block[frames:] = 0
+            self.gains[activeTracks] = volume
+            activeTracks += 1
+
+        if activeTracks == 0:
+            mix.fill(0)
+            return
+        stacked = self.trackBuffer[:activeTracks, :len(mix)].reshape(activeTracks, -1)
+        np.dot(self.gains[:activeTracks], stacked, out = mix.reshape(-1))
+
+    def recordCallbackTime(self, duration, frameCount):
+        """
+        Records how long a playback callback took.
+
+        Args:
+            duration: The time the callback took in seconds.
+            frameCount: The number of frames the callback produced.
+        """
+        self.callbacks += 1
+        self.callbackTime += duration
+        self.maxCallbackTime = max(self.maxCallbackTime, duration)
+        if self.sampleRate:
+            deadline = frameCount / self.sampleRate
+            if duration > deadline:
+                self.missedDeadlines += 1
+            self.instrumentation.observe(AudioPlayer.CALLBACK_HISTOGRAM, duration / deadline)
+
+    def resetStats(self):
+        """Resets the playback statistics."""
+        self.sampleRate = 0
+        self.callbacks = 0
+        self.callbackTime = 0.0
+        self.maxCallbackTime = 0.0
+        self.missedDeadlines = 0
+        self.underruns = 0
+        self.overruns = 0
+
+    def getStats(self):
+        """
+        Gets statistics about playback callbacks, for tuning the number of frames per buffer.
+
+        Returns:
+            A dictionary with the number of callbacks, their mean and maximum duration in seconds,
+            the number of callbacks that took longer than the audio they produced, and the number of output underruns and overruns.
+        """
+        meanTime = self.callbackTime / self.callbacks if self.callbacks else 0.0
+        return {"callbacks": self.callbacks, "meanCallbackTime": meanTime, "maxCallbackTime": self.maxCallbackTime, "missedDeadlines": self.missedDeadlines, "underruns": self.underruns, "overruns": self.overruns}
 
     def play(self):
         """Starts playback for the current audio."""
@@ -85,4 +216,5 @@ class AudioPlayer:
 
     def close(self):
         """Cleans up the player. before quitting the applicaiton."""
-        self.pyaudio.terminate()
\ No newline at end of file
+        if self.pyaudio:
+            self.pyaudio.terminate()
\ No newline at end of file
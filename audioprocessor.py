@@ -1,19 +1,32 @@
+import collections
+import concurrent.futures
+import itertools
 import math
-import midiutil as midi
+import os
 import numpy as np
-from scipy import signal
 import soundfile as sf
 
-import matplotlib
-matplotlib.use("TkAgg")
-import matplotlib.pylab as plt
-
+import analysiscache
 import audioplayer
 import instrument
+import instrumentation
+import jobs
+import lazyimport
+import mappedaudio
+import notearray
+import notecache
+import outputwriter
+import pitchdetector
+import postprocessor
+import streamingrenderer
 
 # Whether to plot the returned signals.
 debug = False
 
+# Dependencies that are slow to import or only needed by some features are imported on first use.
+midi = lazyimport.LazyModule("midiutil")
+plt = lazyimport.plt
+
 class AudioProcessor:
     """Handles direct processing of audio data."""
 
@@ -21,10 +34,77 @@ class AudioProcessor:
     HIGHEST_NOTE = 2093
     # The lowest note that pitch detection will recognize.
     LOWEST_NOTE = 27.5
+    # The default time in seconds between the starts of consecutive pitch detection frames, and the shortest note that can be detected.
+    HOP_DURATION = 1 / 16
+    # The default length in seconds of the audio analyzed for each pitch detection frame, centered on the frame.
+    WINDOW_DURATION = 1 / 16
+    # The number of frames read at a time when streaming an audio file.
+    STREAM_BLOCK_SIZE = 65536
+    # The number of pitch detection frames analyzed by a single task in parallel mode.
+    SEGMENT_FRAMES = 512
+    # The maximum number of bytes of rendered notes kept for reuse.
+    NOTE_CACHE_BYTES = 64 * 1024 * 1024
+    # The maximum number of bytes of synthesized tracks kept for switching between instruments.
+    TRACK_CACHE_BYTES = 512 * 1024 * 1024
+    # The directory that pitch detection results are cached in by default.
+    ANALYSIS_CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "instrumentchanger")
+    # The maximum number of bytes of pitch detection results kept on disk.
+    ANALYSIS_CACHE_BYTES = 256 * 1024 * 1024
     
-    def __init__(self):
+    def __init__(self, workers = 1, prerender = False, streamSynthesis = False, playback = True, midiPath = "output.mid", wavPath = "output.wav", memoryMap = True, cacheDirectory = ANALYSIS_CACHE_DIRECTORY, profile = False, pitchDetector = "autocorrelation",
+        hopDuration = HOP_DURATION, windowDuration = WINDOW_DURATION, verbose = True):
+        """
+        Initializes the processor.
+
+        Args:
+            workers: The number of processes used for pitch detection and synthesis. Everything runs in the current process if 1.
+            prerender: Whether to synthesize the other instruments in the background after a file is loaded.
+            streamSynthesis: Whether to synthesize instruments just in time during playback instead of all at once.
+                The synthesized audio is not written to the WAV file in this mode.
+            playback: Whether to create an audio player. Without one, the processor does not need PyAudio or an audio device.
+            midiPath: The file path that detected notes are written to, or None to not write them.
+            wavPath: The file path that the selected instrument is written to, or None to not write it.
+                The format is chosen by the file extension, for example .wav, .flac or .ogg.
+            memoryMap: Whether to map uncompressed WAV and AIFF files instead of reading them into memory.
+            cacheDirectory: The directory to cache pitch detection results in, so files that were already analyzed are not analyzed again,
+                or None to not cache them.
+            profile: Whether to record how long each stage of processing takes in the processor's instrumentation.
+            pitchDetector: The name of the method used to detect pitches, from pitchdetector.DETECTORS.
+            hopDuration: The time in seconds between the starts of consecutive pitch detection frames.
+            windowDuration: The length in seconds of the audio analyzed for each pitch detection frame.
+                Windows longer than the hop overlap, which finds lower notes more reliably without losing time resolution.
+            verbose: Whether to print statistics of the detected notes.
+        """
+        self.workers = workers
+        self.prerender = prerender
+        self.streamSynthesis = streamSynthesis
+        self.midiPath = midiPath
+        self.wavPath = wavPath
+        self.memoryMap = memoryMap
+        self.hopDuration = hopDuration
+        self.windowDuration = windowDuration
+        self.verbose = verbose
+        self.setPitchDetector(pitchDetector)
+        # Timed spans, counters and histograms of processing and playback. They are only recorded when profiling.
+        self.instrumentation = instrumentation.Instrumentation(profile)
+        self.writer = outputwriter.OutputWriter(self.instrumentation)
+        if cacheDirectory:
+            self.analysisCache = analysiscache.AnalysisCache(cacheDirectory, AudioProcessor.ANALYSIS_CACHE_BYTES)
+        else:
+            self.analysisCache = None
+        # The cache key of the loaded file, or None if its analysis is not cached.
+        self.analysisKey = None
+        # The raw pitch track of each channel of the loaded file, which notes are derived from by post-processing.
+        self.rawTracks = None
+        # The thresholds of post-processing, which can be changed without detecting pitches again.
+        self.softNoteThreshold = postprocessor.SOFT_NOTE_THRESHOLD
+        self.outlierDeviations = postprocessor.OUTLIER_DEVIATIONS
+        self.maxJump = postprocessor.MAX_JUMP
+
         self.fileTrack = AudioTrack()
         self.synthesizedTrack = AudioTrack()
+        # The tracks mixed during playback: the audio file, the selected instrument and any instrument layers added over them.
+        self.tracks = [self.fileTrack, self.synthesizedTrack]
 
         self.notes = None
 
@@ -32,10 +112,29 @@ class AudioProcessor:
         self.audioLength = 0
         self.sampleRate = 0
 
-        self.player = audioplayer.AudioPlayer(self)
+        if playback:
+            self.player = audioplayer.AudioPlayer(self)
+        else:
+            self.player = None
 
         self.instruments = {"Beep": instrument.Beep(), "Acoustic Guitar": instrument.AcousticGuitar(), "Electric Guitar": instrument.ElectricGuitar(), "Trumpet": instrument.Trumpet()}
         self.currentInstrument = None
+        self.currentInstrumentName = None
+
+        # Synthesized tracks are cached by instrument name and the version of the notes they were synthesized from.
+        self.trackCache = notecache.NoteCache(AudioProcessor.TRACK_CACHE_BYTES)
+        self.notesVersion = 0
+        self.prerenderExecutor = concurrent.futures.ThreadPoolExecutor(1)
+        self.prerenderJobs = {}
+
+        # Background jobs run one at a time, and a new job cancels the current one.
+        self.jobExecutor = concurrent.futures.ThreadPoolExecutor(1)
+        self.currentJob = None
+        self.job = None
+
+        self.noteCache = notecache.NoteCache(AudioProcessor.NOTE_CACHE_BYTES)
+        for processorInstrument in self.instruments.values():
+            processorInstrument.noteCache = self.noteCache
 
     def getInstruments(self):
         """
@@ -45,37 +144,189 @@ class AudioProcessor:
         """
         return sorted(self.instruments.keys())
 
-    def loadAudioFile(self, filePath):
+    def loadAudioFile(self, filePath, streaming = False):
         """
         Loads an audio file into the processor.
 
         Args:
             filePath: The file path of the audio file.
+            streaming: Whether to analyze the file block by block instead of loading it into memory.
+                The original audio is not available for playback in this mode.
         """
-        self.player.stop()
-        fileData, self.sampleRate = sf.read(filePath, dtype = 'float32')
-        self.audioLength = len(fileData)
-        try:
-            self.channels = len(fileData[0])
-        except:
-            self.channels = 1
-        self.fileTrack.loadSamples(fileData)
-        self.notes = None
+        self.reportProgress("load")
+        self.stop()
+        if streaming:
+            with self.instrumentation.span("load", file = filePath, streaming = True):
+                info = sf.info(filePath)
+            self.sampleRate = info.samplerate
+            self.audioLength = info.frames
+            self.channels = info.channels
+            self.fileTrack.loadSamples(None)
+            self.setNotes(None)
+            self.rawTracks = None
+            notes = self.loadCachedNotes(filePath)
+            if notes is None:
+                with self.instrumentation.span("detect", frames = self.audioLength, channels = self.channels):
+                    notes = self.detectPitchesStreaming(filePath)
+            self.reportProgress("write")
+            self.setNotes(notes)
+            self.writeMidi(self.notes)
+        else:
+            with self.instrumentation.span("load", file = filePath) as span:
+                fileData = None
+                if self.memoryMap:
+                    fileData = mappedaudio.openMappedAudio(filePath)
+                if fileData is not None:
+                    self.sampleRate = fileData.sampleRate
+                else:
+                    fileData, self.sampleRate = sf.read(filePath, dtype = 'float32')
+                span.setArgs(mapped = isinstance(fileData, mappedaudio.MappedAudio))
+            self.audioLength = len(fileData)
+            if len(fileData.shape) > 1:
+                self.channels = fileData.shape[1]
+            else:
+                self.channels = 1
+            self.fileTrack.loadSamples(fileData)
+            self.setNotes(None)
+            self.rawTracks = None
+            notes = self.loadCachedNotes(filePath)
+            if notes is not None:
+                self.reportProgress("write")
+                self.setNotes(notes)
+                self.writeMidi(self.notes)
         self.synthesizeInstrument()
-        self.player.loadAudioFile()
+        if self.player:
+            self.player.loadAudioFile()
+        if self.prerender:
+            self.prerenderInstruments()
+
+    def loadCachedNotes(self, filePath):
+        """
+        Looks up the raw pitch tracks of an audio file in the analysis cache and post-processes them,
+        and remembers the key of the file so detected pitch tracks can be cached.
+
+        Args:
+            filePath: The file path of the audio file. The sample rate of the file must already be loaded.
+
+        Returns:
+            A list with a NoteArray of the notes of each channel, or None if the file has not been analyzed before.
+        """
+        self.analysisKey = None
+        if not self.analysisCache:
+            return None
+        with self.instrumentation.span("analysis cache lookup") as span:
+            self.analysisKey = self.analysisCache.getKey(filePath, self.getAnalysisParameters(), lambda fraction: self.reportProgress("load", fraction))
+            rawTracks = self.analysisCache.load(self.analysisKey)
+            span.setArgs(hit = rawTracks is not None)
+        if rawTracks is None:
+            return None
+        self.rawTracks = rawTracks
+        return self.postProcess(rawTracks)
+
+    def getAnalysisParameters(self):
+        """
+        Gets the parameters that the raw pitch tracks of pitch detection depend on.
+
+        Returns:
+            A tuple of the parameters.
+        """
+        return (self.sampleRate, self.getIncrement(), self.getWindowLength(), AudioProcessor.LOWEST_NOTE, AudioProcessor.HIGHEST_NOTE, self.pitchDetector.getParameters())
+
+    def setPostProcessing(self, softNoteThreshold = None, outlierDeviations = None, maxJump = None):
+        """
+        Changes the thresholds of post-processing, and derives the notes, MIDI file and instrument tracks of the loaded file again
+        from its raw pitch tracks, without reading or analyzing the audio again.
+
+        Args:
+            softNoteThreshold: The volume [0,1] below which notes are silenced, or None to keep the current threshold.
+            outlierDeviations: The number of standard deviations from the mean pitch beyond which notes are silenced,
+                or None to keep the current number.
+            maxJump: The smallest jump in semitones from the previous note that silences a note lasting a single frame,
+                or None to keep the current jump.
+        """
+        if softNoteThreshold is not None:
+            self.softNoteThreshold = softNoteThreshold
+        if outlierDeviations is not None:
+            self.outlierDeviations = outlierDeviations
+        if maxJump is not None:
+            self.maxJump = maxJump
+        if self.rawTracks is None:
+            return
+
+        notes = self.postProcess(self.rawTracks)
+        self.reportProgress("write")
+        self.setNotes(notes)
+        self.writeMidi(self.notes)
+        for trackIndex in range(1, len(self.tracks)):
+            self.synthesizeTrack(trackIndex)
+        if self.prerender:
+            self.prerenderInstruments()
+
+    def setPitchDetector(self, name):
+        """
+        Selects the method used to detect pitches in audio files loaded afterwards.
+
+        Args:
+            name: The name of the method, from pitchdetector.DETECTORS.
+
+        Raises:
+            ValueError: If there is no method with the name.
+        """
+        self.pitchDetector = pitchdetector.createDetector(name, AudioProcessor.LOWEST_NOTE, AudioProcessor.HIGHEST_NOTE)
 
     def getTrackByIndex(self, trackIndex):
         """
         Gets a track by its index number.
 
         Args:
-            trackIndex: 0 for the file track, 1 for the synthesized track.
+            trackIndex: 0 for the file track, 1 for the synthesized track, and 2 onwards for instrument layers.
         """
-        if trackIndex == 0:
-            track = self.fileTrack
-        else:
-            track = self.synthesizedTrack
-        return track
+        return self.tracks[trackIndex]
+
+    def addInstrumentTrack(self, instrumentName):
+        """
+        Adds a track that layers another instrument over the audio.
+
+        Args:
+            instrumentName: The name of the instrument to synthesize the track with.
+
+        Returns:
+            The index of the new track.
+        """
+        self.tracks.append(AudioTrack(instrumentName))
+        trackIndex = len(self.tracks) - 1
+        self.synthesizeTrack(trackIndex)
+        if self.player:
+            self.player.loadSamples()
+        return trackIndex
+
+    def removeTrack(self, trackIndex):
+        """
+        Removes an instrument layer.
+
+        Args:
+            trackIndex: The index of the instrument layer.
+
+        Raises:
+            ValueError: If the track is the file track or the synthesized track.
+        """
+        if trackIndex < 2:
+            raise ValueError("Only instrument layers can be removed.")
+        track = self.tracks.pop(trackIndex)
+        if self.player:
+            self.player.loadSamples()
+        track.loadSamples(None)
+
+    def setMuted(self, trackIndex, muted):
+        """
+        Sets whether an audio track is muted, keeping its volume.
+
+        Args:
+            trackIndex: The track to mute or unmute.
+            muted: Whether the audio track is muted.
+        """
+        track = self.getTrackByIndex(trackIndex)
+        track.muted = muted
 
     def setEnabled(self, trackIndex, enabled):
         """
@@ -111,7 +362,8 @@ class AudioProcessor:
         self.stop()
         reloadTrack.reload()
 
-        self.player.loadSamples()
+        if self.player:
+            self.player.loadSamples()
 
     def selectInstrument(self, newInstrument = None):
         """
@@ -120,175 +372,303 @@ class AudioProcessor:
         Args:
             newInstrument: The name of the new instrument to select.
         """
+        self.setInstrument(newInstrument)
+        self.synthesizeTrack(1)
+
+    def setInstrument(self, newInstrument):
+        """
+        Sets the instrument of the synthesized track without synthesizing it.
+
+        Args:
+            newInstrument: The name of the new instrument.
+        """
         self.currentInstrument = self.instruments[newInstrument]
-        self.synthesizeInstrument()
+        self.currentInstrumentName = newInstrument
+        self.synthesizedTrack.instrumentName = newInstrument
 
     def synthesizeInstrument(self):
-        """Creates new instrument data to match the current loaded track."""
+        """Creates new instrument data for every instrument track to match the current loaded track."""
+
+        if self.notes is None and self.fileTrack.baseSamples is not None:
+            with self.instrumentation.span("detect", frames = self.audioLength, channels = self.channels):
+                notes = self.detectPitches()
+            self.reportProgress("write")
+            self.setNotes(notes)
+            self.writeMidi(self.notes)
+        for trackIndex in range(1, len(self.tracks)):
+            self.synthesizeTrack(trackIndex)
+
+    def synthesizeTrack(self, trackIndex):
+        """
+        Synthesizes the current notes on the instrument of a track.
 
-        if self.fileTrack.baseSamples is not None:
-            if self.notes is None:
-                self.notes = self.detectPitches()
-                self.writeMidi(self.notes)
-            synthesizedData = self.currentInstrument.matchNotes(self.notes, self.sampleRate)
-            sf.write('output.wav', synthesizedData, self.sampleRate)
-            self.synthesizedTrack.loadSamples(synthesizedData)
-            self.reloadData(1)
+        Args:
+            trackIndex: The index of the track.
+        """
+        track = self.tracks[trackIndex]
+        # The instrument can be changed from another thread while the track is synthesized.
+        instrumentName = track.instrumentName
+        if self.notes is None or not instrumentName:
+            return
+        if self.streamSynthesis:
+            synthesizedData = streamingrenderer.StreamingRenderer(self.instruments[instrumentName], self.notes, self.sampleRate)
+        elif track is self.synthesizedTrack:
+            # Blocks are written as they are synthesized, so the file is not held back until the whole track is done.
+            with self.writer.openAudio(self.wavPath, self.sampleRate, len(self.notes)) as stream:
+                synthesizedData = self.getSynthesizedTrack(instrumentName, stream.write)
+                self.reportProgress("write")
+        else:
+            synthesizedData = self.getSynthesizedTrack(instrumentName)
+        track.loadSamples(synthesizedData)
+        self.reloadData(trackIndex)
+
+    def setNotes(self, notes):
+        """
+        Sets the notes that instruments are synthesized from, discarding tracks synthesized from earlier notes.
+
+        Args:
+            notes: The new notes, or None if they have not been detected yet.
+        """
+        self.notes = notes
+        self.notesVersion += 1
+        for job in self.prerenderJobs.values():
+            job.cancel()
+        self.prerenderJobs = {}
+        self.trackCache.clear()
+
+    def getSynthesizedTrack(self, instrumentName, rendered = None):
+        """
+        Gets the current notes synthesized on an instrument, reusing the track if it was already synthesized.
+
+        Args:
+            instrumentName: The name of the instrument.
+            rendered: A function called with consecutive blocks of the track as they are synthesized, or with the whole track if it was already synthesized.
+
+        Returns:
+            The synthesized samples.
+        """
+        job = self.prerenderJobs.pop(instrumentName, None)
+        if job and not job.cancel():
+            # The instrument is already being synthesized in the background.
+            job.result()
+
+        key = (instrumentName, self.notesVersion)
+        synthesizedData = self.trackCache.get(key)
+        if synthesizedData is None:
+            self.reportProgress("synthesize")
+            with self.instrumentation.span("synthesize", instrument = instrumentName):
+                synthesizedData = self.instruments[instrumentName].matchNotes(self.notes, self.sampleRate, self.workers, lambda fraction: self.reportProgress("synthesize", fraction), rendered)
+            self.instrumentation.count("samples synthesized", synthesizedData.size)
+            self.trackCache.put(key, synthesizedData)
+        elif rendered:
+            rendered(synthesizedData)
+        return synthesizedData
+
+    def prerenderInstruments(self):
+        """Starts synthesizing the instruments that have not been synthesized yet in the background."""
+        if self.notes is None:
+            return
+        for instrumentName in self.getInstruments():
+            if instrumentName not in self.prerenderJobs and self.trackCache.get((instrumentName, self.notesVersion)) is None:
+                self.prerenderJobs[instrumentName] = self.prerenderExecutor.submit(self.prerenderInstrument, instrumentName, self.notes, self.sampleRate, self.notesVersion)
+
+    def prerenderInstrument(self, instrumentName, notes, sampleRate, notesVersion):
+        """
+        Synthesizes an instrument in the background.
+
+        Args:
+            instrumentName: The name of the instrument.
+            notes: The notes to synthesize.
+            sampleRate: The sample rate to synthesize at.
+            notesVersion: The version of the notes. The track is discarded if the notes have changed since.
+        """
+        if notesVersion != self.notesVersion:
+            return
+        with self.instrumentation.span("prerender", instrument = instrumentName):
+            synthesizedData = self.instruments[instrumentName].matchNotes(notes, sampleRate, self.workers)
+        self.instrumentation.count("samples synthesized", synthesizedData.size)
+        if notesVersion == self.notesVersion:
+            self.trackCache.put((instrumentName, notesVersion), synthesizedData)
+
+    def getIncrement(self):
+        """
+        Gets the length of the frames used for pitch detection.
+
+        Returns:
+            The length of a pitch detection frame in samples.
+        """
+        return int(self.sampleRate * self.hopDuration)
+
+    def getWindowLength(self):
+        """
+        Gets the length of the audio analyzed for each pitch detection frame.
+
+        Returns:
+            The length of a pitch detection window in samples. It is never shorter than a frame.
+        """
+        return max(int(self.sampleRate * self.windowDuration), self.getIncrement())
 
     def detectPitches(self):
         """
         Does pitch detection on the currently loaded audio file.
 
         Returns:
-            A list of notes that were detected.
+            A list with a NoteArray of the notes detected in each channel.
         """
         audioData = self.fileTrack.baseSamples
-        notes = []
+        increment = self.getIncrement()
+        windowLength = self.getWindowLength()
+        trackers = []
         for channel in range(self.channels):
-            notes.append([])
-        duration = len(audioData)
-
-        increment = int(self.sampleRate / 16)
-        sampleDuration = increment
-        startIndex = 0
-        lastNote = 0
-        while startIndex < duration:
-            for channel in range(self.channels):
-                channelNotes = notes[channel]
-                endIndex = startIndex + increment
-                if endIndex > duration:
-                    endIndex = duration
-                    sampleDuration = duration - startIndex
-                if self.channels == 1:
-                    currentSamples = audioData[startIndex:endIndex]
-                else:
-                    currentSamples = audioData[startIndex:endIndex, channel]
-
-                # Autocorrelation pitch detection.
-                autocorrelation = signal.correlate(currentSamples, currentSamples)
-                autoLength = len(autocorrelation)
-
-                peakCheck = sampleDuration
-                difference = 0
-                while difference <= 0 and peakCheck + 1 < autoLength:
-                    last = autocorrelation[peakCheck]
-                    current = autocorrelation[peakCheck + 1]
-                    difference = current - last
-                    peakCheck += 1
-        
-                if debug:
-                    time = np.linspace(-self.audioLength / self.sampleRate, self.audioLength / self.sampleRate, autoLength)
-                    plt.plot(time, autocorrelation)
-                    plt.show()
-
-                maxIndex = peakCheck
-                maxValue = 0
-                for i in range(peakCheck, autoLength):
-                    current = abs(autocorrelation[i])
-                    if current > maxValue:
-                        maxValue = current
-                        maxIndex = i
-
-                frequency = self.sampleRate / (maxIndex - sampleDuration)
-                newNote = Note(frequency, sampleDuration)
-                channelNotes.append(newNote)
-
-            startIndex += increment
+            trackers.append(PitchTracker(self.sampleRate, increment, windowLength, self.pitchDetector, self.instrumentation))
+
+        # Split the audio into segments of whole frames so that segments can be analyzed independently.
+        # Segments are sliced as they are needed, so mapped audio is only converted a segment at a time.
+        segmentLength = AudioProcessor.SEGMENT_FRAMES * increment
+        segmentCount = math.ceil(len(audioData) / segmentLength) * self.channels
+
+        if self.workers > 1:
+            # Segments include the audio that the windows of their first and last frames reach into.
+            before = (windowLength - increment) // 2
+            segments = self.getSegments(audioData, segmentLength, before, windowLength - increment - before)
+            with concurrent.futures.ProcessPoolExecutor(self.workers) as executor:
+                # A few segments are analyzed ahead, and their results are stitched back together in order, so notes spanning segment boundaries are merged.
+                pending = collections.deque()
+                for i, (channel, segment, length) in enumerate(segments):
+                    pending.append((channel, executor.submit(analyzeFrames, segment, self.sampleRate, increment, windowLength, self.pitchDetector, length)))
+                    if len(pending) > 2 * self.workers:
+                        channel, future = pending.popleft()
+                        self.reportProgress("detect", (i - len(pending)) / segmentCount)
+                        trackers[channel].addFrameResults(*future.result())
+                for channel, future in pending:
+                    trackers[channel].addFrameResults(*future.result())
+                return self.processNotes(trackers, executor)
+
+        # Trackers keep the audio that the windows of the next frames reach back into themselves.
+        for i, (channel, segment, length) in enumerate(self.getSegments(audioData, segmentLength)):
+            self.reportProgress("detect", i / segmentCount)
+            trackers[channel].addSamples(segment)
+        return self.processNotes(trackers)
+
+    def getSegments(self, audioData, segmentLength, before = 0, after = 0):
+        """
+        Splits audio into segments of each channel.
 
-        for channel in range(self.channels):
+        Args:
+            audioData: The samples of the audio, as an array or mapped audio.
+            segmentLength: The number of frames in each segment.
+            before: The number of frames before each segment to include. Frames before the start of the audio are silent.
+            after: The number of frames after each segment to include, where the audio has them.
+
+        Yields:
+            A tuple of the channel, the samples of each segment and the number of frames in the segment without the ones
+            before and after it, in order within each channel.
+        """
+        for start in range(0, len(audioData), segmentLength):
+            length = min(segmentLength, len(audioData) - start)
+            block = audioData[max(start - before, 0):start + segmentLength + after]
+            if start < before:
+                silence = np.zeros((before - start,) + block.shape[1:], dtype = block.dtype)
+                block = np.concatenate((silence, block))
             if self.channels == 1:
-                currentSamples = audioData
+                yield 0, block, length
             else:
-                currentSamples = audioData[:, channel]
-            channelNotes = notes[channel]
-
-            def mergeNotes():
-                """Merges notes that are very similar to each other."""
-                i = 0
-                prevNote = None
-                while i < len(channelNotes):
-                    currentNote = channelNotes[i]
-                    currentMidi = currentNote.midi
-
-                    if not self.isNoteInRange(currentNote.frequency):
-                        # 0-out notes that are below A0 or above C8.
-                        currentNote.setZero()
-                        currentMidi = 0
-
-
-                    if not prevNote:
-                        prevNote = currentNote
-                        i += 1
-                        continue
-
-                    prevMidi = prevNote.midi
-
-                    if currentMidi == prevMidi:
-                        # Merge notes that are about the same (within a semitone).
-                        prevNote.duration += currentNote.duration
-                        del channelNotes[i]
-                    else:
-                        prevNote = currentNote
-                        i += 1
-
-            mergeNotes()
-
-            # Find the maximum volume of the track.
-            peak = 0
-            for sample in currentSamples:
-                peak = max(abs(sample), peak)
-
-            # Change volumes of notes based on peaks of original track.
-            timeCounter = 0
-            for note in channelNotes:
-                if note.frequency > 0:
-                    noteEnd = timeCounter + note.duration
-                    maxSample = 0
-                    for i in range(timeCounter, noteEnd):
-                        maxSample = max(maxSample, abs(currentSamples[i]))
-                    note.volume = maxSample / peak
-                timeCounter += note.duration
-
-            # 0-out notes that are too soft.
-            for note in channelNotes:
-                if note.frequency > 0 and note.volume < 0.2:
-                    note.setZero()
-
-            mergeNotes()
-            
-            # 0 out notes that deviate too far.
-            usedNotes = []
-            for note in channelNotes:
-                if self.isNoteInRange(note.frequency):
-                    for i in range(int(note.duration / increment)):
-                        usedNotes.append(note.midi)
-            mean = np.mean(usedNotes)
-            deviation = np.std(usedNotes)
-            print("Mean:", mean)
-            print("Standard deviation:", deviation)
-            lastNote = None
-            for note in channelNotes:
-                difference = abs(note.midi - mean)
-                lastDifference = 0
-                if lastNote:
-                    lastDifference = abs(lastNote - note.midi)
-                if difference > deviation * 2:
-                    # Throw out notes that deviate too far from the mean.
-                    note.setZero()
-                elif (lastDifference > deviation * 2 or lastDifference >= 12) and note.duration == increment:
-                    # Throw out notes that make too large of a jump.
-                    note.setZero()
-                if note.midi > 0:
-                    lastNote = note.midi
-                elif note.duration > increment:
-                    # Reset last note if there is silence for a while.
-                    lastNote = None
-
-            mergeNotes()
-                
-                
-        print("Notes:", notes[0])
+                for channel in range(self.channels):
+                    yield channel, block[:, channel], length
+
+    def detectPitchesStreaming(self, filePath, blockSize = None):
+        """
+        Does pitch detection on an audio file by reading it block by block, without loading the whole file into memory.
+
+        Args:
+            filePath: The file path of the audio file.
+            blockSize: The number of frames to read from the file at a time. Defaults to STREAM_BLOCK_SIZE.
+
+        Returns:
+            A list with a NoteArray of the notes detected in each channel.
+        """
+        if not blockSize:
+            blockSize = AudioProcessor.STREAM_BLOCK_SIZE
+        increment = self.getIncrement()
+        windowLength = self.getWindowLength()
+        trackers = []
+        for channel in range(self.channels):
+            trackers.append(PitchTracker(self.sampleRate, increment, windowLength, self.pitchDetector, self.instrumentation))
+
+        framesRead = 0
+        for block in sf.blocks(filePath, blocksize = blockSize, dtype = 'float32', always_2d = True):
+            self.reportProgress("detect", framesRead / max(self.audioLength, 1))
+            for channel, tracker in enumerate(trackers):
+                tracker.addSamples(block[:, channel])
+            framesRead += len(block)
+
+        return self.processNotes(trackers)
+
+    def processNotes(self, trackers, executor = None):
+        """
+        Keeps the raw pitch tracks found by pitch detection, caching them if the file has a cache key, and cleans up their notes.
+
+        Args:
+            trackers: The pitch trackers of each channel, after all samples have been added to them.
+            executor: An executor to clean up the channels in parallel with. Channels are cleaned up serially if not given.
+
+        Returns:
+            A list with a NoteArray of the notes detected in each channel.
+        """
+        rawTracks = []
+        for tracker in trackers:
+            trackerNotes, trackerPeaks = tracker.finish()
+            rawTracks.append((trackerNotes, trackerPeaks, tracker.peak))
+
+            if debug:
+                time = np.linspace(0, self.audioLength / self.sampleRate, len(trackerNotes))
+                plt.plot(time, [note.frequency for note in trackerNotes])
+                plt.show()
+
+        self.rawTracks = rawTracks
+        if self.analysisKey:
+            with self.instrumentation.span("analysis cache save"):
+                self.analysisCache.save(self.analysisKey, rawTracks)
+        return self.postProcess(rawTracks, executor)
+
+    def postProcess(self, rawTracks, executor = None):
+        """
+        Cleans up the notes of raw pitch tracks with the current post-processing thresholds. The raw pitch tracks are not changed.
+
+        Args:
+            rawTracks: The raw pitch track of each channel, as a tuple of the detected notes as a NoteArray,
+                the peak sample magnitude of each note and the peak sample magnitude of the channel.
+            executor: An executor to clean up the channels in parallel with. Channels are cleaned up serially if not given.
 
+        Returns:
+            A list with a NoteArray of the notes of each channel.
+        """
+        self.reportProgress("post-process")
+        increment = self.getIncrement()
+        # Post-processing changes the notes in place, so it works on copies of the raw pitch tracks.
+        channelNotes = [rawNotes.copy() for rawNotes, rawPeaks, peak in rawTracks]
+        notePeaks = [rawPeaks for rawNotes, rawPeaks, peak in rawTracks]
+        peaks = [peak for rawNotes, rawPeaks, peak in rawTracks]
+        thresholds = [itertools.repeat(threshold) for threshold in (increment, self.softNoteThreshold, self.outlierDeviations, self.maxJump)]
+
+        with self.instrumentation.span("post-process", channels = len(rawTracks)):
+            if executor:
+                results = executor.map(postprocessor.processChannelNotes, channelNotes, notePeaks, peaks, *thresholds)
+            else:
+                results = map(postprocessor.processChannelNotes, channelNotes, notePeaks, peaks, *thresholds)
+
+            notes = []
+            for processedNotes, mean, deviation, mergeCounts in results:
+                if self.verbose:
+                    print("Mean:", mean)
+                    print("Standard deviation:", deviation)
+                notes.append(processedNotes)
+                for mergeName, notesBefore, notesAfter in mergeCounts:
+                    self.instrumentation.count("notes before " + mergeName + " merge", notesBefore)
+                    self.instrumentation.count("notes after " + mergeName + " merge", notesAfter)
+
+        if self.verbose:
+            print("Notes:", notes[0])
         return notes
 
     def writeMidi(self, notes):
@@ -296,7 +676,22 @@ class AudioProcessor:
         Writes notes to a MIDI file.
 
         Args:
-            notes: The notes to write to MIDI.
+            notes: The notes to write to MIDI, as a list with a NoteArray or a list of Note objects for each channel.
+        """
+        if not self.midiPath:
+            return
+        with self.instrumentation.span("create MIDI"):
+            self.writer.writeMidi(self.midiPath, self.createMidi(notes))
+
+    def createMidi(self, notes):
+        """
+        Creates a MIDI file of notes.
+
+        Args:
+            notes: The notes to write to MIDI, as a list with a NoteArray or a list of Note objects for each channel.
+
+        Returns:
+            The MIDIFile.
         """
         track = 0
         channel = 0
@@ -337,29 +732,136 @@ class AudioProcessor:
         midiFile = midi.MIDIFile(1)
         midiFile.addTempo(track, time, tempo)
 
+        channelNotes = notearray.NoteArray.fromNotes(notes[0])
+        velocities = (127 * channelNotes.volume).astype(int)
         started = False
-        for note in notes[0]:
-            if note.midi > 0:
-                midiFile.addNote(track, channel, note.midi, time / samplesPerBeat, note.duration / samplesPerBeat, int(127 * note.volume))
+        for midiNumber, duration, velocity in zip(channelNotes.midi.tolist(), channelNotes.duration.tolist(), velocities.tolist()):
+            if midiNumber > 0:
+                midiFile.addNote(track, channel, midiNumber, time / samplesPerBeat, duration / samplesPerBeat, velocity)
                 started = True
             # Ignore silence at the beginning of the note sequence.
             if started:
-                time += note.duration
+                time += duration
 
-        with open("output.mid", "wb") as output_file:
-            midiFile.writeFile(output_file)
+        return midiFile
 
-    def isNoteInRange(self, note):
+    @staticmethod
+    def isNoteInRange(note):
         """
         Checks if a note is in the audio processor's range.
 
         Args:
-            note: The note to check.
+            note: The frequency of the note to check, or an array of frequencies.
 
         Returns:
             Whether the note is in the audio processor's range.
         """
-        return note >= AudioProcessor.LOWEST_NOTE and note <= AudioProcessor.HIGHEST_NOTE
+        return (note >= AudioProcessor.LOWEST_NOTE) & (note <= AudioProcessor.HIGHEST_NOTE)
+
+    def loadAudioFileAsync(self, filePath, streaming = False):
+        """
+        Loads an audio file into the processor in the background, cancelling any work that is still running.
+
+        Args:
+            filePath: The file path of the audio file.
+            streaming: Whether to analyze the file block by block instead of loading it into memory.
+
+        Returns:
+            The job loading the file.
+        """
+        return self.startJob(self.loadAudioFile, filePath, streaming)
+
+    def selectInstrumentAsync(self, newInstrument):
+        """
+        Selects a new instrument in the background, cancelling any work that is still running.
+
+        Args:
+            newInstrument: The name of the new instrument to select.
+
+        Returns:
+            The job synthesizing the instrument.
+        """
+        # The instrument is set right away, so a job that cancels this one before it runs still uses it.
+        self.setInstrument(newInstrument)
+        return self.startJob(self.synthesizeTrack, 1)
+
+    def setPostProcessingAsync(self, softNoteThreshold = None, outlierDeviations = None, maxJump = None):
+        """
+        Changes the thresholds of post-processing in the background, cancelling any work that is still running.
+
+        Args:
+            softNoteThreshold: The volume [0,1] below which notes are silenced, or None to keep the current threshold.
+            outlierDeviations: The number of standard deviations from the mean pitch beyond which notes are silenced,
+                or None to keep the current number.
+            maxJump: The smallest jump in semitones from the previous note that silences a note lasting a single frame,
+                or None to keep the current jump.
+
+        Returns:
+            The job deriving the notes and instrument tracks again.
+        """
+        return self.startJob(self.setPostProcessing, softNoteThreshold, outlierDeviations, maxJump)
+
+    def addInstrumentTrackAsync(self, instrumentName):
+        """
+        Adds an instrument layer in the background, cancelling any work that is still running.
+
+        Args:
+            instrumentName: The name of the instrument to synthesize the track with.
+
+        Returns:
+            The job synthesizing the track.
+        """
+        return self.startJob(self.addInstrumentTrack, instrumentName)
+
+    def startJob(self, task, *args):
+        """
+        Runs a task on the job thread after cancelling the current job.
+
+        Args:
+            task: The processor method to run.
+            args: The arguments to the method.
+
+        Returns:
+            The job running the task.
+        """
+        if self.currentJob:
+            self.currentJob.cancel()
+        job = jobs.Job()
+        self.currentJob = job
+        self.jobExecutor.submit(self.runJob, job, task, args)
+        return job
+
+    def runJob(self, job, task, args):
+        """
+        Runs a task for a job on the job thread.
+
+        Args:
+            job: The job running the task.
+            task: The processor method to run.
+            args: The arguments to the method.
+        """
+        self.job = job
+        try:
+            job.setProgress(None)
+            task(*args)
+            job.finish(jobs.Job.DONE)
+        except jobs.JobCancelled:
+            job.finish(jobs.Job.CANCELLED)
+        except Exception as error:
+            job.finish(jobs.Job.FAILED, error)
+        finally:
+            self.job = None
+
+    def reportProgress(self, stage, progress = 0.0):
+        """
+        Reports the progress of the running job, stopping it if it has been cancelled. Does nothing outside of a job.
+
+        Args:
+            stage: The stage of processing that is running.
+            progress: The fraction [0,1] of the stage that is done.
+        """
+        if self.job:
+            self.job.setProgress(stage, progress)
 
     def initialized(self):
         """
@@ -372,38 +874,84 @@ class AudioProcessor:
 
     def play(self):
         """Starts playback for the current audio."""
-        self.player.play()
+        if self.player:
+            self.player.play()
 
     def pause(self):
         """Pauses playback for the current audio."""
-        self.player.pause()
+        if self.player:
+            self.player.pause()
 
     def stop(self):
         """Stop playback for the current audio."""
-        self.player.stop()
+        if self.player:
+            self.player.stop()
 
     def close(self):
         """Cleans up the processor before quitting the applicaiton."""
-        self.player.close()
+        if self.currentJob:
+            self.currentJob.cancel()
+        self.jobExecutor.shutdown(wait = False, cancel_futures = True)
+        self.prerenderExecutor.shutdown(wait = False, cancel_futures = True)
+        if self.player:
+            self.player.close()
+        self.writer.close()
+
+def analyzeFrames(samples, sampleRate, increment, windowLength, detector, length):
+    """
+    Detects the pitches of samples starting on a frame boundary.
+
+    Args:
+        samples: The samples of a single channel, starting with the (windowLength - increment) // 2 samples before the first frame
+            that its window reaches back into, and ending with any samples after the last frame that its window reaches into.
+        sampleRate: The sample rate of the samples.
+        increment: The length of each pitch detection frame in samples.
+        windowLength: The length of the window analyzed for each frame in samples.
+        detector: The PitchDetector to detect pitches with.
+        length: The number of samples in the frames.
+
+    Returns:
+        A tuple of the frequency, duration in samples and peak sample magnitude of each frame.
+    """
+    frequencies, durations = detector.detectFrequencies(samples, sampleRate, increment, windowLength, length)
+    start = (windowLength - increment) // 2
+    framePeaks = np.maximum.reduceat(np.abs(samples[start:start + length]), np.arange(0, length, increment))
+    return frequencies, durations, framePeaks
 
 class AudioTrack():
-    """Data about an audio track."""
+    """
+    Data about an audio track.
+
+    The track owns the samples loaded into it as baseSamples, and closes them when other samples are loaded if they can be closed.
+    The samples played back refer to the same buffer, so reloading the track never copies it.
+    """
 
-    def __init__(self):
-        """Initializes an audio track."""
+    def __init__(self, instrumentName = None):
+        """
+        Initializes an audio track.
+
+        Args:
+            instrumentName: The name of the instrument the track is synthesized with, or None if it is not synthesized.
+        """
+        self.baseSamples = None
         self.loadSamples(None)
+        self.instrumentName = instrumentName
         self.volume = np.float32(1.0)
         self.enabled = True
+        self.muted = False
 
     def loadSamples(self, samples):
         """
         Loads samples into the audio track.
 
         Args:
-            samples: The samples in the audio track.
+            samples: The samples in the audio track, as an array or an object that is sliced like one, such as mapped audio or a streaming renderer.
         """
+        previousSamples = self.baseSamples
         self.samples = samples
         self.baseSamples = samples
+        if previousSamples is not None and previousSamples is not samples and hasattr(previousSamples, "close"):
+            previousSamples.close()
 
     def reload(self):
         """
@@ -421,11 +969,112 @@ class AudioTrack():
         Returns:
             The volume of the audio track.
         """
-        if self.enabled:
+        if self.enabled and not self.muted:
             return self.volume
         else:
             return 0
 
+class PitchTracker():
+    """Incrementally detects the pitches of a single channel of audio."""
+
+    def __init__(self, sampleRate, increment, windowLength, detector, instrumentation = instrumentation.DISABLED):
+        """
+        Initializes a pitch tracker.
+
+        Args:
+            sampleRate: The sample rate of the audio.
+            increment: The length of each pitch detection frame in samples.
+            windowLength: The length of the window analyzed for each frame in samples.
+            detector: The PitchDetector to detect pitches with.
+            instrumentation: The instrumentation to record the time spent analyzing and merging in.
+        """
+        self.sampleRate = sampleRate
+        self.increment = increment
+        self.windowLength = windowLength
+        self.detector = detector
+        self.instrumentation = instrumentation
+        # The window of the first frame reaches back into silence before the audio.
+        self.before = (windowLength - increment) // 2
+        self.pending = np.zeros(self.before, dtype = np.float32)
+        self.noteChunks = []
+        self.peakChunks = []
+        self.peak = np.float32(0)
+
+    def addSamples(self, samples):
+        """
+        Detects the pitches of the next samples in the channel.
+
+        Samples of frames whose windows are not complete yet are held back until more samples are added or the tracker is finished,
+        along with the samples before them that their windows reach back into.
+
+        Args:
+            samples: The next samples in the channel.
+        """
+        if len(self.pending) > 0:
+            samples = np.concatenate((self.pending, samples))
+        frameCount = max((len(samples) - self.windowLength) // self.increment + 1, 0)
+        frameEnd = frameCount * self.increment
+        self.addFrames(samples[:frameEnd - self.increment + self.windowLength], frameEnd)
+        self.pending = np.array(samples[frameEnd:])
+
+    def finish(self):
+        """
+        Detects the pitch of any remaining samples.
+
+        Returns:
+            A tuple of the detected notes as a NoteArray, with repeated notes merged, and the peak sample magnitude of each note.
+        """
+        self.addFrames(self.pending, len(self.pending) - self.before)
+        self.pending = np.zeros(0, dtype = np.float32)
+
+        # Merge notes that continue across the chunks that were added.
+        with self.instrumentation.span("merge"):
+            notes = notearray.NoteArray.concatenate(self.noteChunks)
+            notePeaks = np.concatenate(self.peakChunks) if self.peakChunks else np.zeros(0, dtype = np.float32)
+            self.instrumentation.count("notes before chunk merge", len(notes))
+            runStarts = notes.merge()
+            self.instrumentation.count("notes after chunk merge", len(notes))
+            if len(runStarts) > 0:
+                notePeaks = np.maximum.reduceat(notePeaks, runStarts)
+        self.noteChunks = [notes]
+        self.peakChunks = [notePeaks]
+        return notes, notePeaks
+
+    def addFrames(self, samples, length):
+        """
+        Detects the pitches of samples starting on a frame boundary.
+
+        Args:
+            samples: The samples to detect the pitches of, with the samples before and after the frames that their windows reach into.
+            length: The number of samples in the frames.
+        """
+        if length > 0:
+            with self.instrumentation.span("analyze frames", samples = length):
+                results = analyzeFrames(samples, self.sampleRate, self.increment, self.windowLength, self.detector, length)
+            self.addFrameResults(*results)
+
+    def addFrameResults(self, frequencies, durations, framePeaks):
+        """
+        Adds the pitches detected in the next frames of the channel.
+
+        Args:
+            frequencies: The frequency of each frame.
+            durations: The duration in samples of each frame.
+            framePeaks: The peak sample magnitude of each frame.
+        """
+        if len(framePeaks) == 0:
+            return
+        self.peak = max(self.peak, framePeaks.max())
+        self.instrumentation.count("frames analyzed", len(framePeaks))
+
+        with self.instrumentation.span("merge"):
+            notes = notearray.NoteArray.fromFrequencies(frequencies, durations)
+            runStarts = notes.merge()
+            self.noteChunks.append(notes)
+            self.peakChunks.append(np.maximum.reduceat(framePeaks, runStarts))
+        self.instrumentation.count("notes before frame merge", len(framePeaks))
+        self.instrumentation.count("notes after frame merge", len(notes))
+
 class Note():
     """A description of a note in a track."""
 
@@ -448,6 +1097,11 @@ class Note():
         Args:
             frequency: The frequency of the note.
         """
+        if frequency <= 0:
+            # Frames too short to hold a period have no pitch.
+            self.midi = 0
+            self.frequency = 0
+            return
         self.midi = round(69 + 12 * math.log(frequency / 440, 2))
         # Round the frequency to nearest semitone.
         self.frequency = 2 ** ((self.midi - 69) / 12) * 440
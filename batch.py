@@ -0,0 +1,189 @@
+import argparse
+import concurrent.futures
+import os
+import time
+
+import soundfile as sf
+
+import audioprocessor
+import pitchdetector
+
+# The formats that synthesized audio can be written in.
+AUDIO_FORMATS = ["wav", "flac", "ogg"]
+# The soundfile format of each file extension that is searched for in directories.
+# Extensions whose format the installed libsndfile cannot read are skipped.
+INPUT_FORMATS = {"wav": "WAV", "wave": "WAV", "w64": "W64", "rf64": "RF64", "aif": "AIFF", "aiff": "AIFF", "aifc": "AIFF", "au": "AU", "snd": "AU", "caf": "CAF", "flac": "FLAC", "ogg": "OGG", "oga": "OGG", "opus": "OGG", "mp3": "MP3"}
+
+def findAudioFiles(paths, instrumentNames):
+    """
+    Finds the audio files to convert.
+
+    Args:
+        paths: File paths and directories. Directories are searched recursively for files in a format that can be read.
+        instrumentNames: The names of the instruments. Synthesized audio written by earlier conversions is skipped in directories.
+
+    Returns:
+        A list of tuples of the file path of each audio file and its path relative to the directory it was found in,
+        or its file name if it was given directly.
+    """
+    availableFormats = sf.available_formats()
+    extensions = {extension for extension, audioFormat in INPUT_FORMATS.items() if audioFormat in availableFormats}
+    outputSuffixes = tuple("." + getInstrumentSuffix(instrumentName) + "." + audioFormat for instrumentName in instrumentNames for audioFormat in AUDIO_FORMATS)
+    audioFiles = []
+    for path in paths:
+        if not os.path.isdir(path):
+            audioFiles.append((path, os.path.basename(path)))
+            continue
+        for directory, directoryNames, fileNames in os.walk(path):
+            directoryNames.sort()
+            for fileName in sorted(fileNames):
+                if os.path.splitext(fileName)[1][1:].lower() in extensions and not fileName.lower().endswith(outputSuffixes):
+                    filePath = os.path.join(directory, fileName)
+                    audioFiles.append((filePath, os.path.relpath(filePath, path)))
+    return audioFiles
+
+def getInstrumentSuffix(instrumentName):
+    """
+    Gets the part of the file names of synthesized audio that names the instrument.
+
+    Args:
+        instrumentName: The name of the instrument.
+
+    Returns:
+        The instrument name in lower case, with dashes instead of spaces.
+    """
+    return instrumentName.lower().replace(" ", "-")
+
+def getOutputPaths(filePath, relativePath, outputDirectory, instrumentName, audioFormat):
+    """
+    Gets the file paths that the results of converting an audio file are written to.
+
+    Args:
+        filePath: The file path of the audio file.
+        relativePath: The path of the audio file relative to the directory it was found in. Its directories are kept under the output directory.
+        outputDirectory: The directory to write to, or None to write next to the audio file.
+        instrumentName: The name of the instrument the audio file is synthesized with.
+        audioFormat: The file extension of the synthesized audio.
+
+    Returns:
+        A tuple of the MIDI file path and the synthesized audio file path.
+    """
+    if outputDirectory is None:
+        outputDirectory = os.path.dirname(filePath)
+    else:
+        outputDirectory = os.path.join(outputDirectory, os.path.dirname(relativePath))
+    name = os.path.splitext(os.path.basename(filePath))[0]
+    return os.path.join(outputDirectory, name + ".mid"), os.path.join(outputDirectory, name + "." + getInstrumentSuffix(instrumentName) + "." + audioFormat)
+
+def findDuplicateOutputs(audioFiles, outputDirectory, instrumentName, audioFormat):
+    """
+    Finds audio files whose results would be written to the same files as another audio file's.
+
+    Args:
+        audioFiles: The audio files to convert, as returned by findAudioFiles.
+        outputDirectory: The directory to write to, or None to write next to each audio file.
+        instrumentName: The name of the instrument to synthesize the notes with.
+        audioFormat: The file extension of the synthesized audio.
+
+    Returns:
+        A list of the file paths of the audio files that share a MIDI file path with an earlier audio file.
+    """
+    midiPaths = set()
+    duplicates = []
+    for filePath, relativePath in audioFiles:
+        midiPath = os.path.normcase(os.path.abspath(getOutputPaths(filePath, relativePath, outputDirectory, instrumentName, audioFormat)[0]))
+        if midiPath in midiPaths:
+            duplicates.append(filePath)
+        midiPaths.add(midiPath)
+    return duplicates
+
+def convertFile(filePath, relativePath, outputDirectory, instrumentName, audioFormat, pitchDetector):
+    """
+    Detects the notes of an audio file and synthesizes them on an instrument, without playback.
+
+    Args:
+        filePath: The file path of the audio file.
+        relativePath: The path of the audio file relative to the directory it was found in.
+        outputDirectory: The directory to write to, or None to write next to the audio file.
+        instrumentName: The name of the instrument to synthesize the notes with.
+        audioFormat: The file extension of the synthesized audio.
+        pitchDetector: The name of the method used to detect pitches.
+
+    Returns:
+        The length of the audio file in seconds.
+    """
+    midiPath, wavPath = getOutputPaths(filePath, relativePath, outputDirectory, instrumentName, audioFormat)
+    os.makedirs(os.path.dirname(midiPath) or ".", exist_ok = True)
+    processor = audioprocessor.AudioProcessor(playback = False, midiPath = midiPath, wavPath = wavPath, pitchDetector = pitchDetector, verbose = False)
+    try:
+        processor.selectInstrument(instrumentName)
+        processor.loadAudioFile(filePath)
+        return processor.audioLength / processor.sampleRate
+    finally:
+        processor.close()
+
+def convertFiles(audioFiles, outputDirectory, instrumentName, audioFormat, pitchDetector, workers):
+    """
+    Converts audio files on a pool of processes, printing the result of each file and a summary.
+
+    Args:
+        audioFiles: The audio files, as returned by findAudioFiles.
+        outputDirectory: The directory to write to, or None to write next to each audio file.
+        instrumentName: The name of the instrument to synthesize the notes with.
+        audioFormat: The file extension of the synthesized audio.
+        pitchDetector: The name of the method used to detect pitches.
+        workers: The number of files converted at the same time.
+
+    Returns:
+        The number of files that could not be converted.
+    """
+    startTime = time.perf_counter()
+    audioSeconds = 0.0
+    failures = 0
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(convertFile, filePath, relativePath, outputDirectory, instrumentName, audioFormat, pitchDetector) for filePath, relativePath in audioFiles]
+        for (filePath, relativePath), future in zip(audioFiles, futures):
+            try:
+                duration = future.result()
+            except Exception as error:
+                failures += 1
+                print("Failed:", filePath, "-", error)
+                continue
+            audioSeconds += duration
+            print("Converted:", filePath)
+    elapsed = time.perf_counter() - startTime
+
+    converted = len(audioFiles) - failures
+    print("Converted {} of {} files in {:.2f} s".format(converted, len(audioFiles), elapsed))
+    if elapsed > 0:
+        print("Throughput: {:.2f} files/s, {:.2f} audio seconds per second".format(converted / elapsed, audioSeconds / elapsed))
+    return failures
+
+def main():
+    """Converts audio files from the command line."""
+    parser = argparse.ArgumentParser(description = "Converts audio files to MIDI and synthesizes them on an instrument, without the GUI.")
+    parser.add_argument("paths", nargs = "+", help = "audio files, or directories to search for audio files")
+    parser.add_argument("-o", "--output", help = "directory to write results to (default: next to each input)")
+    parser.add_argument("-i", "--instrument", default = "Beep", help = "instrument to synthesize (default: Beep)")
+    parser.add_argument("-f", "--format", default = "wav", choices = AUDIO_FORMATS, help = "format of the synthesized audio (default: wav)")
+    parser.add_argument("-d", "--detector", default = "autocorrelation", choices = list(pitchdetector.DETECTORS), help = "pitch detection method (default: autocorrelation)")
+    parser.add_argument("-w", "--workers", type = int, default = os.cpu_count(), help = "number of files converted at the same time")
+    args = parser.parse_args()
+
+    processor = audioprocessor.AudioProcessor(playback = False)
+    instruments = processor.getInstruments()
+    processor.close()
+    if args.instrument not in instruments:
+        parser.error("unknown instrument {!r}, choose from: {}".format(args.instrument, ", ".join(instruments)))
+
+    audioFiles = findAudioFiles(args.paths, instruments)
+    if not audioFiles:
+        parser.error("no audio files found")
+    duplicates = findDuplicateOutputs(audioFiles, args.output, args.instrument, args.format)
+    if duplicates:
+        parser.error("these files would overwrite the results of other files with the same name: " + ", ".join(duplicates))
+    failures = convertFiles(audioFiles, args.output, args.instrument, args.format, args.detector, args.workers)
+    raise SystemExit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
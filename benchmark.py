@@ -0,0 +1,516 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import soundfile as sf
+
+import audioplayer
+import audioprocessor
+import instrument
+import pitchdetector
+
+# The most time in seconds that importing the audio processor may take.
+IMPORT_TIME_BUDGET = 0.4
+# The number of times the import is timed, in fresh interpreters.
+IMPORT_RUNS = 5
+# Modules that must not be imported until they are used.
+LAZY_MODULES = ["matplotlib", "midiutil", "pyaudio", "scipy.fft", "scipy.signal"]
+
+# The sample rates that inputs are generated at.
+SAMPLE_RATES = [22050, 44100]
+# The lengths in seconds of the generated inputs.
+LENGTHS = [5, 20]
+# The number of times each benchmark is timed. The fastest time is reported.
+REPEATS = 5
+# The file that baseline results are saved to and compared against by default.
+BASELINE_PATH = "benchmark-baseline.json"
+# The fraction by which a benchmark may be slower than its baseline before it counts as a regression.
+TIME_THRESHOLD = 0.25
+# The fraction by which a benchmark may use more peak memory than its baseline before it counts as a regression.
+MEMORY_THRESHOLD = 0.25
+# The instrument used for the end-to-end pipeline.
+PIPELINE_INSTRUMENT = "Trumpet"
+# The MIDI numbers of the tones that pitch detectors are checked against, from the lowest to the highest detected note.
+DETECTOR_NOTES = list(range(21, 97, 3))
+# The relative amplitudes of the harmonics of the tones that pitch detectors are checked against.
+HARMONIC_AMPLITUDES = [1.0, 0.7, 0.5, 0.35, 0.25]
+# The number of pitch detection frames that each tone lasts.
+TONE_FRAMES = 4
+
+# Times an import in a fresh interpreter and reports which lazy modules it loaded.
+IMPORT_SCRIPT = """
+import sys
+import time
+start = time.perf_counter()
+import audioprocessor
+print(time.perf_counter() - start)
+print(",".join(name for name in {} if name in sys.modules))
+"""
+
+def measureImportTime(runs = IMPORT_RUNS):
+    """
+    Measures how long importing the audio processor takes.
+
+    Args:
+        runs: The number of fresh interpreters to time the import in.
+
+    Returns:
+        A tuple of the median import time in seconds and the lazy modules that were imported eagerly.
+    """
+    script = IMPORT_SCRIPT.format(LAZY_MODULES)
+    directory = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    eagerModules = set()
+    for run in range(runs):
+        output = subprocess.run([sys.executable, "-c", script], cwd = directory, capture_output = True, text = True, check = True).stdout
+        importTime, modules = output.splitlines()[-2:]
+        times.append(float(importTime))
+        eagerModules.update(filter(None, modules.split(",")))
+    return statistics.median(times), sorted(eagerModules)
+
+def checkImportTime():
+    """
+    Checks that importing the audio processor stays within its time budget without loading optional dependencies.
+
+    Returns:
+        Whether the check passed.
+    """
+    importTime, eagerModules = measureImportTime()
+    passed = importTime <= IMPORT_TIME_BUDGET and not eagerModules
+    print("import audioprocessor: {:.3f} s (budget {:.3f} s)".format(importTime, IMPORT_TIME_BUDGET))
+    if eagerModules:
+        print("Imported eagerly:", ", ".join(eagerModules))
+    return passed
+
+def createSweep(sampleRate, seconds, channels):
+    """
+    Creates an exponential sine sweep across the range of pitch detection.
+
+    Args:
+        sampleRate: The sample rate of the sweep.
+        seconds: The length of the sweep in seconds.
+        channels: The number of channels. Each channel after the first sweeps down instead of up.
+
+    Returns:
+        A float32 array of the sweep, with a column for each channel if there is more than one.
+    """
+    time = np.arange(int(sampleRate * seconds)) / sampleRate
+    low = 55.0
+    high = 1760.0
+    rate = np.log(high / low) / seconds
+    channelSamples = []
+    for channel in range(channels):
+        if channel % 2:
+            phase = 2 * np.pi * high / -rate * (np.exp(-rate * time) - 1)
+        else:
+            phase = 2 * np.pi * low / rate * (np.exp(rate * time) - 1)
+        channelSamples.append(0.5 * np.sin(phase))
+    samples = np.stack(channelSamples, axis = 1).astype(np.float32)
+    if channels == 1:
+        return samples[:, 0]
+    return samples
+
+def createNoteSequence(sampleRate, seconds, channels, seed = 0):
+    """
+    Creates a random sequence of sine notes, with short pauses and varying volumes.
+
+    Args:
+        sampleRate: The sample rate of the notes.
+        seconds: The length of the sequence in seconds.
+        channels: The number of channels. Each channel has its own sequence.
+        seed: The seed of the random sequence.
+
+    Returns:
+        A float32 array of the notes, with a column for each channel if there is more than one.
+    """
+    random = np.random.RandomState(seed)
+    length = int(sampleRate * seconds)
+    samples = np.zeros((length, channels), dtype = np.float32)
+    for channel in range(channels):
+        start = 0
+        while start < length:
+            duration = int(sampleRate * random.uniform(0.1, 0.6))
+            end = min(start + duration, length)
+            if random.rand() > 0.15:
+                frequency = 440 * 2 ** ((random.randint(40, 85) - 69) / 12)
+                time = np.arange(end - start) / sampleRate
+                samples[start:end, channel] = random.uniform(0.3, 0.9) * np.sin(2 * np.pi * frequency * time)
+            start = end
+    if channels == 1:
+        return samples[:, 0]
+    return samples
+
+def createTones(sampleRate, midiNumbers, toneLength, seed = 0):
+    """
+    Creates a sequence of harmonic tones with a little noise.
+
+    Args:
+        sampleRate: The sample rate of the tones.
+        midiNumbers: The MIDI number of each tone.
+        toneLength: The length of each tone in samples.
+        seed: The seed of the noise.
+
+    Returns:
+        A float32 array of the tones.
+    """
+    random = np.random.RandomState(seed)
+    time = np.arange(toneLength) / sampleRate
+    tones = []
+    for midi in midiNumbers:
+        frequency = 440 * 2 ** ((midi - 69) / 12)
+        tone = np.zeros(toneLength)
+        for harmonic, amplitude in enumerate(HARMONIC_AMPLITUDES, 1):
+            if frequency * harmonic < sampleRate / 2:
+                tone += amplitude * np.sin(2 * np.pi * frequency * harmonic * time + random.uniform(0, 2 * np.pi))
+        tones.append(0.5 * tone / np.abs(tone).max())
+    samples = np.concatenate(tones) + 0.005 * random.standard_normal(toneLength * len(midiNumbers))
+    return samples.astype(np.float32)
+
+def measureDetectorAccuracy(detector, sampleRate):
+    """
+    Measures how accurately a pitch detector finds the pitches of harmonic tones across the range of pitch detection.
+
+    Args:
+        detector: The pitch detector.
+        sampleRate: The sample rate of the tones.
+
+    Returns:
+        A dictionary with the fractions of frames that were detected within half a semitone, off by one or more octaves,
+        and not detected at all, and the mean error in cents of the frames within half a semitone.
+    """
+    processor = createProcessor()
+    processor.sampleRate = sampleRate
+    increment = processor.getIncrement()
+    processor.close()
+    samples = createTones(sampleRate, DETECTOR_NOTES, increment * TONE_FRAMES)
+    frequencies = detector.detectFrequencies(samples, sampleRate, increment)[0][:len(DETECTOR_NOTES) * TONE_FRAMES]
+    expected = np.repeat(DETECTOR_NOTES, TONE_FRAMES)
+
+    detected = frequencies > 0
+    errors = np.full(len(frequencies), np.inf)
+    errors[detected] = 12 * np.log2(frequencies[detected] / 440) + 69 - expected[detected]
+    correct = np.abs(errors) < 0.5
+    octaves = np.round(errors / 12)
+    octaveErrors = detected & (octaves != 0) & (np.abs(errors - 12 * octaves) < 0.5)
+    return {
+        "correct": correct.mean(),
+        "octaveErrors": octaveErrors.mean(),
+        "undetected": 1 - detected.mean(),
+        "cents": np.abs(errors[correct]).mean() * 100 if correct.any() else np.nan,
+    }
+
+def compareDetectors(sampleRates):
+    """
+    Prints how accurately each pitch detector finds the pitches of harmonic tones.
+
+    Args:
+        sampleRates: The sample rates to generate tones at.
+    """
+    print("{:<50} {:>9} {:>9} {:>11} {:>9}".format("pitch detector accuracy", "correct", "octave", "undetected", "cents"))
+    for sampleRate in sampleRates:
+        for name in pitchdetector.DETECTORS:
+            detector = pitchdetector.createDetector(name, audioprocessor.AudioProcessor.LOWEST_NOTE, audioprocessor.AudioProcessor.HIGHEST_NOTE)
+            accuracy = measureDetectorAccuracy(detector, sampleRate)
+            print("{:<50} {:>9.1%} {:>9.1%} {:>11.1%} {:>9.1f}".format("{}/{}Hz".format(name, sampleRate), accuracy["correct"], accuracy["octaveErrors"], accuracy["undetected"], accuracy["cents"]))
+
+# The generated inputs, by name.
+SIGNALS = {"sweep": createSweep, "notes": createNoteSequence}
+
+def createProcessor():
+    """
+    Creates a processor that does not play, write or cache anything.
+
+    Returns:
+        The processor.
+    """
+    return audioprocessor.AudioProcessor(playback = False, midiPath = None, wavPath = None, cacheDirectory = None)
+
+def loadSamples(processor, samples, sampleRate):
+    """
+    Loads samples into a processor as if they had been read from a file.
+
+    Args:
+        processor: The processor.
+        samples: The samples, with a column for each channel if there is more than one.
+        sampleRate: The sample rate of the samples.
+    """
+    processor.sampleRate = sampleRate
+    processor.audioLength = len(samples)
+    processor.channels = samples.shape[1] if samples.ndim > 1 else 1
+    processor.fileTrack.loadSamples(samples)
+
+def detectNotes(samples, sampleRate):
+    """
+    Detects the notes of samples.
+
+    Args:
+        samples: The samples, with a column for each channel if there is more than one.
+        sampleRate: The sample rate of the samples.
+
+    Returns:
+        A list with a NoteArray of the notes of each channel.
+    """
+    processor = createProcessor()
+    try:
+        loadSamples(processor, samples, sampleRate)
+        return processor.detectPitches()
+    finally:
+        processor.close()
+
+def getNoteFrequencies(count, seed = 0):
+    """
+    Gets random frequencies of notes across the range of the instruments.
+
+    Args:
+        count: The number of frequencies.
+        seed: The seed of the random frequencies.
+
+    Returns:
+        A list of the frequencies.
+    """
+    random = np.random.RandomState(seed)
+    return [440 * 2 ** ((midi - 69) / 12) for midi in random.randint(40, 85, count)]
+
+def getBenchmarks(sampleRates, lengths):
+    """
+    Gets the benchmarks to run.
+
+    Args:
+        sampleRates: The sample rates to generate inputs at.
+        lengths: The lengths in seconds of the generated inputs.
+
+    Returns:
+        A list of tuples of the name of each benchmark, a function that prepares it and returns the function to time,
+        and the seconds of audio that it processes.
+    """
+    benchmarks = []
+    longest = max(lengths)
+    processor = createProcessor()
+    instrumentTypes = {instrumentName: type(processorInstrument) for instrumentName, processorInstrument in processor.instruments.items()}
+    processor.close()
+    for sampleRate in sampleRates:
+        for channels in (1, 2):
+            channelName = "mono" if channels == 1 else "stereo"
+            for signalName, createSignal in SIGNALS.items():
+                for seconds in lengths:
+                    def prepare(createSignal = createSignal, sampleRate = sampleRate, seconds = seconds, channels = channels):
+                        samples = createSignal(sampleRate, seconds, channels)
+                        return lambda: detectNotes(samples, sampleRate)
+                    benchmarks.append(("detectPitches/{}/{}/{}Hz/{}s".format(signalName, channelName, sampleRate, seconds), prepare, seconds))
+
+            def prepare(sampleRate = sampleRate, channels = channels):
+                processor = createProcessor()
+                loadSamples(processor, createNoteSequence(sampleRate, longest, channels), sampleRate)
+                processor.detectPitches()
+                processor.close()
+                return lambda: processor.postProcess(processor.rawTracks)
+            benchmarks.append(("postProcess/notes/{}/{}Hz/{}s".format(channelName, sampleRate, longest), prepare, longest))
+
+            if channels == 1:
+                for detectorName in pitchdetector.DETECTORS:
+                    def prepare(detectorName = detectorName, sampleRate = sampleRate):
+                        samples = createNoteSequence(sampleRate, longest, 1)
+                        detector = pitchdetector.createDetector(detectorName, audioprocessor.AudioProcessor.LOWEST_NOTE, audioprocessor.AudioProcessor.HIGHEST_NOTE)
+                        increment = int(sampleRate / 16)
+                        return lambda: detector.detectFrequencies(samples, sampleRate, increment)
+                    benchmarks.append(("pitchDetector/{}/{}Hz/{}s".format(detectorName, sampleRate, longest), prepare, longest))
+
+            for instrumentName in sorted(instrumentTypes):
+                def prepare(instrumentType = instrumentTypes[instrumentName], sampleRate = sampleRate, channels = channels):
+                    notes = detectNotes(createNoteSequence(sampleRate, longest, channels), sampleRate)
+                    # A new instrument has no note cache, so every note is synthesized.
+                    noteInstrument = instrumentType()
+                    return lambda: noteInstrument.matchNotes(notes, sampleRate)
+                benchmarks.append(("matchNotes/{}/{}/{}Hz/{}s".format(instrumentName, channelName, sampleRate, longest), prepare, longest))
+
+            def prepare(sampleRate = sampleRate, channels = channels):
+                directory = tempfile.TemporaryDirectory()
+                filePath = os.path.join(directory.name, "input.wav")
+                sf.write(filePath, createNoteSequence(sampleRate, longest, channels), sampleRate)
+                def run():
+                    processor = audioprocessor.AudioProcessor(playback = False, midiPath = os.path.join(directory.name, "output.mid"), wavPath = os.path.join(directory.name, "output.wav"), cacheDirectory = None)
+                    try:
+                        processor.selectInstrument(PIPELINE_INSTRUMENT)
+                        processor.loadAudioFile(filePath)
+                    finally:
+                        processor.close()
+                return run, directory.cleanup
+            benchmarks.append(("pipeline/{}/{}/{}Hz/{}s".format(PIPELINE_INSTRUMENT, channelName, sampleRate, longest), prepare, longest))
+
+            def prepare(sampleRate = sampleRate, channels = channels):
+                return preparePlayback(sampleRate, longest, channels)
+            benchmarks.append(("playCallback/4 tracks/{}/{}Hz/{}s".format(channelName, sampleRate, longest), prepare, longest))
+
+        noteSeconds = 0.5
+        frequencies = getNoteFrequencies(40)
+        def prepare(sampleRate = sampleRate):
+            guitar = instrument.AcousticGuitar()
+            return lambda: [guitar.getBaseStringSound(frequency, int(noteSeconds * sampleRate), sampleRate) for frequency in frequencies]
+        benchmarks.append(("getBaseStringSound/{}Hz/{} notes".format(sampleRate, len(frequencies)), prepare, noteSeconds * len(frequencies)))
+
+        def prepare(sampleRate = sampleRate):
+            trumpet = instrument.Trumpet()
+            return lambda: [trumpet.getNote(frequency, int(noteSeconds * sampleRate), sampleRate) for frequency in frequencies]
+        benchmarks.append(("Trumpet.getNote/{}Hz/{} notes".format(sampleRate, len(frequencies)), prepare, noteSeconds * len(frequencies)))
+    return benchmarks
+
+def preparePlayback(sampleRate, seconds, channels):
+    """
+    Prepares a player that mixes the source and three instrument layers, without an audio device.
+
+    Args:
+        sampleRate: The sample rate of the audio.
+        seconds: The length of the audio in seconds.
+        channels: The number of channels.
+
+    Returns:
+        A function that mixes all of the audio through the playback callback.
+    """
+    samples = createNoteSequence(sampleRate, seconds, channels)
+    processor = createProcessor()
+    loadSamples(processor, samples, sampleRate)
+    processor.close()
+    for seed in range(3):
+        track = audioprocessor.AudioTrack()
+        track.loadSamples(createNoteSequence(sampleRate, seconds, channels, seed + 1))
+        processor.tracks.append(track)
+    player = audioplayer.AudioPlayer(processor)
+    player.channels = channels
+    player.sampleRate = sampleRate
+    player.audioLength = len(samples)
+    player.allocateBuffers(player.framesPerBuffer, len(processor.tracks))
+    player.loadSamples()
+
+    def run():
+        player.playIndex = 0
+        while player.playCallback(None, player.framesPerBuffer, None, 0)[1] == audioplayer.CALLBACK_CONTINUE:
+            pass
+    return run
+
+def runBenchmark(prepare, audioSeconds, repeats):
+    """
+    Times a benchmark and measures its peak memory.
+
+    Args:
+        prepare: A function that prepares the benchmark and returns the function to time,
+            or a tuple of it and a function that cleans up after the benchmark.
+        audioSeconds: The seconds of audio that the benchmark processes.
+        repeats: The number of times to time the benchmark.
+
+    Returns:
+        A dictionary with the fastest time in seconds, the audio seconds processed per second and the peak bytes allocated.
+    """
+    times = []
+    # Debug output of the processor is hidden so it does not swamp the results.
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.ExitStack() as cleanups:
+        run = prepare()
+        if isinstance(run, tuple):
+            run, cleanup = run
+            cleanups.callback(cleanup)
+        run()
+        for repeat in range(repeats):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+
+        # Memory is traced in a separate run, since tracing slows allocations down.
+        tracemalloc.start()
+        try:
+            run()
+            peakBytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    seconds = min(times)
+    return {"seconds": seconds, "throughput": audioSeconds / seconds, "peakBytes": peakBytes}
+
+def compareResults(results, baseline, timeThreshold, memoryThreshold):
+    """
+    Compares results against a baseline.
+
+    Args:
+        results: The results of each benchmark, by name.
+        baseline: The baseline results of each benchmark, by name.
+        timeThreshold: The fraction by which a benchmark may be slower than its baseline.
+        memoryThreshold: The fraction by which a benchmark may use more peak memory than its baseline.
+
+    Returns:
+        A dictionary with a list of the regressions of each benchmark that regressed, by name.
+    """
+    regressions = {}
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        problems = []
+        if result["seconds"] > base["seconds"] * (1 + timeThreshold):
+            problems.append("time {:+.0%}".format(result["seconds"] / base["seconds"] - 1))
+        if result["peakBytes"] > base["peakBytes"] * (1 + memoryThreshold):
+            problems.append("memory {:+.0%}".format(result["peakBytes"] / base["peakBytes"] - 1))
+        if problems:
+            regressions[name] = problems
+    return regressions
+
+def main():
+    """Runs the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description = "Benchmarks pitch detection, synthesis and playback on generated audio.")
+    parser.add_argument("-k", "--filter", default = "", help = "only run benchmarks whose name contains this text")
+    parser.add_argument("--quick", action = "store_true", help = "only use the lowest sample rate and shortest length")
+    parser.add_argument("--repeats", type = int, default = REPEATS, help = "number of timed runs of each benchmark (default: {})".format(REPEATS))
+    parser.add_argument("--baseline", default = BASELINE_PATH, help = "baseline file to compare against (default: {})".format(BASELINE_PATH))
+    parser.add_argument("--save-baseline", action = "store_true", help = "save the results as the new baseline instead of comparing")
+    parser.add_argument("--time-threshold", type = float, default = TIME_THRESHOLD, help = "allowed slowdown as a fraction (default: {})".format(TIME_THRESHOLD))
+    parser.add_argument("--memory-threshold", type = float, default = MEMORY_THRESHOLD, help = "allowed peak memory increase as a fraction (default: {})".format(MEMORY_THRESHOLD))
+    parser.add_argument("--skip-import", action = "store_true", help = "do not check the import time budget")
+    args = parser.parse_args()
+
+    passed = True
+    if not args.skip_import:
+        passed = checkImportTime()
+
+    sampleRates = SAMPLE_RATES[:1] if args.quick else SAMPLE_RATES
+    lengths = LENGTHS[:1] if args.quick else LENGTHS
+    benchmarks = [benchmark for benchmark in getBenchmarks(sampleRates, lengths) if args.filter in benchmark[0]]
+    if any(name.startswith("pitchDetector/") for name, prepare, audioSeconds in benchmarks):
+        compareDetectors(sampleRates)
+
+    results = {}
+    print("{:<50} {:>10} {:>12} {:>10}".format("benchmark", "time (s)", "x realtime", "peak (MB)"))
+    for name, prepare, audioSeconds in benchmarks:
+        result = runBenchmark(prepare, audioSeconds, args.repeats)
+        results[name] = result
+        print("{:<50} {:>10.4f} {:>12.1f} {:>10.1f}".format(name, result["seconds"], result["throughput"], result["peakBytes"] / 2 ** 20))
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as baselineFile:
+                baseline = json.load(baselineFile)
+        baseline.update(results)
+        with open(args.baseline, "w") as baselineFile:
+            json.dump(baseline, baselineFile, indent = 2, sort_keys = True)
+        print("Saved baseline to", args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+        regressions = compareResults(results, baseline, args.time_threshold, args.memory_threshold)
+        for name, problems in sorted(regressions.items()):
+            print("Regression:", name, "-", ", ".join(problems))
+        if regressions:
+            passed = False
+        else:
+            print("No regressions against", args.baseline)
+    else:
+        print("No baseline found at", args.baseline, "- results were not checked for regressions. Use --save-baseline to create one.")
+    raise SystemExit(0 if passed else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import numpy as np
+
+import lazyimport
+
+signal = lazyimport.LazyModule("scipy.signal")
+
+def lowPass(samples, alpha, state = None):
+    """
+    Applies a one-pole low-pass filter, where each output moves towards the previous output by alpha.
+
+    Args:
+        samples: The samples to filter.
+        alpha: The smoothing factor [0,1] of the filter.
+        state: The filter state returned by a previous call, to continue filtering from where it left off.
+            If not given, the first output is the first sample.
+
+    Returns:
+        A tuple of the filtered samples and the filter state after the last sample.
+    """
+    if len(samples) == 0:
+        return np.zeros(0), state
+    if state is None:
+        state = np.array([alpha * samples[0]])
+    return signal.lfilter([1 - alpha], [1, -alpha], samples, zi = state)
+
+def highPass(samples, alpha, state = None):
+    """
+    Applies a one-pole high-pass filter.
+
+    Args:
+        samples: The samples to filter.
+        alpha: The filter coefficient [0,1], computed from the RC time constant of the filter.
+        state: The filter state returned by a previous call, to continue filtering from where it left off.
+            If not given, the first output is the first sample.
+
+    Returns:
+        A tuple of the filtered samples and the filter state after the last sample.
+    """
+    if len(samples) == 0:
+        return np.zeros(0), state
+    if state is None:
+        state = np.array([(1 - alpha) * samples[0]])
+    return signal.lfilter([alpha, -alpha], [1, -alpha], samples, zi = state)
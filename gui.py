@@ -5,6 +5,7 @@ import os
 import traceback
 
 import audioprocessor
+import jobs
 
 class Gui:
     """The main GUI screen."""
@@ -20,6 +21,11 @@ class Gui:
         self.processor = audioprocessor.AudioProcessor()
 
         self.error = None
+        # The background job that the GUI is waiting on.
+        self.job = None
+        self.polling = False
+        # Whether an audio file has been loaded successfully, so the controls can be used again after a later load fails.
+        self.fileLoaded = False
 
         rowCounter = 0
         self.createButton("Load audio file", self.loadAudioFile, rowCounter, 0)
@@ -27,6 +33,10 @@ class Gui:
         rowCounter += 1
         # Error text.
 
+        rowCounter += 1
+        self.status = Label(self.frame, text = "")
+        self.status.grid(row = rowCounter, column = 0)
+
         rowCounter += 1
         self.playFrame = Frame(self.frame)
         self.playFrame.grid(row = rowCounter, column = 0)
@@ -148,13 +158,9 @@ class Gui:
         if not audioFile:
             return
 
-        try:
-            self.processor.loadAudioFile(audioFile)
-            self.setPlayButtonsEnabled(True)
-            self.resetErrorText()
-        except RuntimeError:
-            error = "Invalid file type."
-            self.setErrorText(error)
+        self.setPlayButtonsEnabled(False)
+        self.resetErrorText()
+        self.startJob(self.processor.loadAudioFileAsync(audioFile), True)
 
     def selectInstrument(self, selectedInstrument):
         """
@@ -163,7 +169,48 @@ class Gui:
         Args:
             selectedInstrument: The new instrument to be used.
         """
-        self.processor.selectInstrument(selectedInstrument)
+        self.startJob(self.processor.selectInstrumentAsync(selectedInstrument), False)
+
+    def startJob(self, job, loadingFile):
+        """
+        Starts waiting on a background job, replacing the job that was being waited on.
+
+        Args:
+            job: The job to wait on.
+            loadingFile: Whether the job is loading a new audio file.
+        """
+        self.job = job
+        self.jobLoadingFile = loadingFile
+        if not self.polling:
+            self.polling = True
+            self.pollJob()
+
+    def pollJob(self):
+        """Updates the status text with the progress of the current job until it finishes."""
+        state, stage, progress = self.job.getStatus()
+        if state == jobs.Job.RUNNING:
+            if stage:
+                self.status.config(text = stage.capitalize() + "... " + str(int(progress * 100)) + "%")
+            self.root.after(100, self.pollJob)
+            return
+
+        self.polling = False
+        self.status.config(text = "")
+        if state == jobs.Job.DONE:
+            if self.jobLoadingFile:
+                self.fileLoaded = True
+                self.setPlayButtonsEnabled(True)
+            self.resetErrorText()
+        else:
+            # The previous audio file is still loaded when loading a new one fails or is cancelled.
+            if self.jobLoadingFile and self.fileLoaded:
+                self.setPlayButtonsEnabled(True)
+            if state == jobs.Job.FAILED:
+                if isinstance(self.job.error, RuntimeError):
+                    error = "Invalid file type."
+                else:
+                    error = str(self.job.error)
+                self.setErrorText(error)
 
     def setErrorText(self, errorText):
         """
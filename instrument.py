@@ -1,61 +1,181 @@
+import concurrent.futures
+import functools
+from multiprocessing import shared_memory
 import numpy as np
-import queue
-
-import matplotlib
-matplotlib.use("TkAgg")
-import matplotlib.pylab as plt
 
 import audioprocessor
+import filters
+import lazyimport
+import notearray
+import wavetable
+
+plt = lazyimport.plt
 
 # Whether to plot the returned signals.
 debug = False
 
 class Instrument:
     """A synthesized instrument."""
-    
-    def matchNotes(self, notes, sampleRate):
+
+    # The cache of rendered notes shared by instruments, or None to render every note.
+    noteCache = None
+
+    def matchNotes(self, notes, sampleRate, workers = 1, progress = None, rendered = None):
         """
         Creates a musical excerpt that attempts to match the given notes on the instrument.
 
         Args:
-            notes: The notes to produce sounds for.
+            notes: The notes to produce sounds for, as a list with a NoteArray or a list of Note objects for each channel.
+            sampleRate: The sample rate to create audio for.
+            workers: The number of processes to render notes with. Notes are rendered in the current process if 1.
+            progress: A function called with the fraction [0,1] of notes rendered so far.
+            rendered: A function called with consecutive blocks of the output, from the start, as soon as no later note changes them.
+                The blocks must not be modified.
+
+        Returns:
+            A float32 array of samples that match the given notes, with a column for each channel if there is more than one.
+        """
+        channelNotes = [notearray.NoteArray.fromNotes(channel) for channel in notes]
+        length = max([int(channel.duration.sum()) for channel in channelNotes] + [0])
+        if len(channelNotes) > 1:
+            shape = (length, len(channelNotes))
+        else:
+            shape = (length,)
+        schedule = getNoteSchedule(channelNotes)
+
+        if workers > 1 and len(schedule[0]) > 1:
+            return self.renderParallel(schedule, shape, sampleRate, workers, progress, rendered)
+
+        samples = np.zeros(shape, dtype = np.float32)
+        blocks = RenderedBlocks(samples, rendered)
+        self.renderSchedule(samples, schedule, sampleRate, progress, blocks.finish)
+        blocks.finish(length)
+        return samples
+
+    def renderParallel(self, schedule, shape, sampleRate, workers, progress = None, rendered = None):
+        """
+        Renders notes on a process pool into a shared output buffer.
+
+        Args:
+            schedule: The notes to render, from getNoteSchedule.
+            shape: The shape of the output.
             sampleRate: The sample rate to create audio for.
+            workers: The number of processes to render notes with.
+            progress: A function called with the fraction [0,1] of batches rendered so far.
+            rendered: A function called with consecutive copies of blocks of the output, from the start, as soon as no later batch changes them.
 
         Returns:
-            A list of samples that match the given notes.
+            A float32 array of the rendered samples.
+        """
+        nbytes = max(int(np.prod(shape)) * np.dtype(np.float32).itemsize, 1)
+        sharedBuffer = shared_memory.SharedMemory(create = True, size = nbytes)
+        try:
+            samples = np.ndarray(shape, dtype = np.float32, buffer = sharedBuffer.buf)
+            samples[:] = 0
+            # The shared buffer is released before the caller is done with the blocks, so they are copied out of it.
+            blocks = RenderedBlocks(samples, rendered, copy = True)
+
+            # Notes are independent, so each batch writes its own sections of the buffer.
+            # The schedule is sorted by start, so a batch only writes after where the batch before it starts.
+            numBatches = min(workers * 4, len(schedule[0]))
+            batches = list(zip(*[np.array_split(column, numBatches) for column in schedule]))
+            with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+                futures = [executor.submit(renderBatch, self, sharedBuffer.name, shape, batch, sampleRate) for batch in batches]
+                try:
+                    for i, future in enumerate(futures):
+                        future.result()
+                        if progress:
+                            progress((i + 1) / len(futures))
+                        if i + 1 < len(batches):
+                            blocks.finish(int(batches[i + 1][1][0]))
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+            blocks.finish(shape[0])
+
+            result = samples.copy()
+            del samples
+        finally:
+            sharedBuffer.close()
+            sharedBuffer.unlink()
+        return result
+
+    def renderSchedule(self, output, schedule, sampleRate, progress = None, finished = None):
         """
-        samples = []
+        Synthesizes scheduled notes directly into an output buffer.
 
+        Args:
+            output: The output buffer, with a column for each channel if there is more than one.
+            schedule: The notes to render, from getNoteSchedule.
+            sampleRate: The sample rate to create audio for.
+            progress: A function called with the fraction [0,1] of notes rendered so far.
+            finished: A function called with the start of each note before it is rendered, as every frame before it is final by then.
+        """
+        channels, offsets, durations, frequencies, volumes = schedule
+        for i, (channel, offset, duration, frequency, volume) in enumerate(zip(channels.tolist(), offsets.tolist(), durations.tolist(), frequencies.tolist(), volumes)):
+            if progress and i % 32 == 0:
+                progress(i / len(channels))
+            if finished:
+                finished(offset)
+            if output.ndim > 1:
+                channelSamples = output[:, channel]
+            else:
+                channelSamples = output
+            self.renderNote(channelSamples[offset:offset + duration], frequency, volume, sampleRate)
+
+    def renderNote(self, output, frequency, volume, sampleRate):
+        """
+        Synthesizes a note directly into an output buffer.
+
+        Args:
+            output: The section of the output buffer to write the note into. The note lasts for the whole section.
+            frequency: The frequency of the note.
+            volume: The volume [0,1] of the note.
+            sampleRate: The sample rate to create audio for.
+        """
+        newSamples = self.getCachedNote(frequency, len(output), sampleRate)
+
+        # Low-pass filter to smooth out sound.
         lpfCutoff = audioprocessor.AudioProcessor.HIGHEST_NOTE
         alpha = lpfCutoff / sampleRate
-        for channel in notes:
-            channelSamples = []
-            for note in channel:
-                if note.frequency == 0:
-                    newSamples = np.zeros(note.duration)
-                else:
-                    newSamples = self.getNote(note.frequency, note.duration, sampleRate)
-
-                numSamples = len(newSamples)
-                # Low-pass filter to smooth out sound.
-                for i in range(1, numSamples):
-                    newSamples[i] += alpha * (newSamples[i - 1] - newSamples[i])
-                
-                for i in range(0, numSamples):
-                    newSamples[i] *= note.volume
-
-                for sample in newSamples:
-                    channelSamples.append(np.float32(sample))
-
-            samples.append(channelSamples)
-
-        if len(notes) > 1:
-            samples = np.transpose(samples)
-        else:
-            samples = samples[0]
+        newSamples, state = filters.lowPass(newSamples, alpha)
 
+        np.multiply(newSamples, volume, out = output, casting = 'unsafe')
+
+    def getCachedNote(self, frequency, duration, sampleRate):
+        """
+        Gets a note from the note cache, rendering and caching it if it is not cached yet.
+
+        Args:
+            frequency: The frequency of the note.
+            duration: The duration of the note in samples.
+            sampleRate: The sample rate to create audio for.
+
+        Returns:
+            An array of samples representing the note, before smoothing and volume are applied.
+        """
+        if self.noteCache is None:
+            return self.getNote(frequency, duration, sampleRate)
+
+        key = (type(self).__name__, self.getParameters(), frequency, duration, sampleRate)
+        samples = self.noteCache.get(key)
+        if samples is None:
+            # Instruments are shared between threads, so the seeded generator is only passed to this note.
+            random = np.random.RandomState(self.noteCache.getSeed(key)) if self.noteCache.seeded else np.random
+            samples = np.asarray(self.getNote(frequency, duration, sampleRate, random))
+            self.noteCache.put(key, samples)
         return samples
 
+    def getParameters(self):
+        """
+        Gets the parameters that change how the instrument sounds.
+
+        Returns:
+            A hashable tuple of the instrument's parameters.
+        """
+        return ()
+
     def duplicateChannel(self, channel):
         """
         Duplicates a single channel of data into two channels.
@@ -64,18 +184,101 @@ class Instrument:
             channel: The single channel to duplicate.
 
         Returns:
-            A double-channel list duplicated from the single channel
+            A double-channel float32 array duplicated from the single channel
+        """
+        halved = (np.asarray(channel) / 2).astype(np.float32)
+        return np.column_stack((halved, halved))
+
+def getNoteSchedule(channelNotes):
+    """
+    Finds where each note that makes a sound starts in the output.
+
+    Args:
+        channelNotes: A NoteArray of the notes in each channel.
+
+    Returns:
+        A tuple of arrays with the channel, start offset, duration, frequency and volume of each note that is not silent,
+        sorted by where the notes start.
+    """
+    channels = []
+    offsets = []
+    durations = []
+    frequencies = []
+    volumes = []
+    for channelIndex, channel in enumerate(channelNotes):
+        channelOffsets = np.cumsum(channel.duration) - channel.duration
+        channelFrequencies = channel.frequency
+        pitched = channelFrequencies != 0
+        channels.append(np.full(np.count_nonzero(pitched), channelIndex))
+        offsets.append(channelOffsets[pitched])
+        durations.append(channel.duration[pitched])
+        frequencies.append(channelFrequencies[pitched])
+        volumes.append(channel.volume[pitched])
+    if not channels:
+        return (np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros(0), np.zeros(0, dtype = np.float32))
+    order = np.argsort(np.concatenate(offsets), kind = "stable")
+    return tuple(np.concatenate(column)[order] for column in (channels, offsets, durations, frequencies, volumes))
+
+def renderBatch(instrument, bufferName, shape, schedule, sampleRate):
+    """
+    Renders a batch of notes into a shared output buffer from a worker process.
+
+    Args:
+        instrument: The instrument to render the notes with.
+        bufferName: The name of the shared memory holding the output.
+        shape: The shape of the output.
+        schedule: The notes to render, from getNoteSchedule.
+        sampleRate: The sample rate to create audio for.
+    """
+    sharedBuffer = shared_memory.SharedMemory(name = bufferName)
+    try:
+        output = np.ndarray(shape, dtype = np.float32, buffer = sharedBuffer.buf)
+        instrument.renderSchedule(output, schedule, sampleRate)
+        del output
+    finally:
+        sharedBuffer.close()
+
+class RenderedBlocks:
+    """Passes the final frames at the start of an output buffer to a function a block at a time, while notes are rendered into it."""
+
+    # The smallest number of frames passed at a time, other than at the end of the output.
+    BLOCK_SIZE = 65536
+
+    def __init__(self, output, rendered, copy = False):
+        """
+        Initializes the rendered blocks of an output buffer.
+
+        Args:
+            output: The output buffer.
+            rendered: The function to pass the blocks to, or None to not pass them anywhere.
+            copy: Whether to pass copies of the blocks instead of views of the output buffer.
+        """
+        self.output = output
+        self.rendered = rendered
+        self.copy = copy
+        # The number of frames passed so far.
+        self.position = 0
+
+    def finish(self, frames):
         """
-        newSamples = []
-        for sample in channel:
-            sample32 = np.float32(sample / 2)
-            newSamples.append((sample32, sample32))
-        return newSamples
+        Passes the frames before a position once there are enough of them to fill a block.
+
+        Args:
+            frames: The number of frames at the start of the output that are final.
+        """
+        if not self.rendered or frames - self.position < min(RenderedBlocks.BLOCK_SIZE, len(self.output) - self.position) or frames <= self.position:
+            return
+        block = self.output[self.position:frames]
+        self.rendered(block.copy() if self.copy else block)
+        self.position = frames
 
 class Beep(Instrument):
     """A sine wave."""
 
-    def getNote(self, frequency, duration, sampleRate):
+    # A single cycle of a sine wave.
+    table = wavetable.Wavetable([1])
+
+    def getNote(self, frequency, duration, sampleRate, random = np.random):
         """
         Gets a note of a certain frequency.
 
@@ -83,18 +286,20 @@ class Beep(Instrument):
             frequency: The frequency of the note.
             duration: The duration of the note in samples.
             sampleRate: The sample rate to create audio for.
+            random: The random number generator to synthesize the note with.
 
         Returns:
-            A list of samples representing the note.
+            An array of samples representing the note.
         """
         seconds = duration / sampleRate
 
         # Try to end the wave close to 0.
         truncatedSeconds = int(seconds * frequency) / frequency
         waveDuration = int(int(seconds * frequency) * sampleRate / frequency)
-        time = np.linspace(0, truncatedSeconds, waveDuration)
-        samples = np.sin(frequency * 2 * np.pi * time)
-        samples = np.append(samples, np.zeros(duration - waveDuration))
+        samples = np.zeros(duration)
+        if waveDuration > 1:
+            # The wave is stretched slightly so that its last sample lands on the end of the last cycle.
+            samples[:waveDuration] = Beep.table.render(frequency * truncatedSeconds / (waveDuration - 1), waveDuration)
 
         return samples
 
@@ -105,49 +310,67 @@ class AcousticGuitar(Instrument):
         """Initializes an acoustic guitar instrument."""
         self.delaySize = 200
 
-    def getBaseStringSound(self, frequency, duration, sampleRate):
+    def getParameters(self):
+        """
+        Gets the parameters that change how the instrument sounds.
+
+        Returns:
+            A hashable tuple of the instrument's parameters.
+        """
+        return (self.delaySize,)
+
+    def getBaseStringSound(self, frequency, duration, sampleRate, random = np.random):
         """
         Gets a plucked string note without any distortion effects.
 
         Args:
             frequency: The frequency of the note.
             duration: The duration of the note in samples.
+            random: The random number generator to excite the string with.
 
         Returns:
-            A list of samples representing the note.
+            An array of float32 samples representing the note.
         """
-        samples = []
-
         # Karplus-Strong algorithm, subtractive synthesis from white noise
         bufferLength = int(sampleRate / frequency)
-        buffer = np.random.standard_normal(bufferLength)
+        excitation = random.standard_normal(bufferLength)
 
         # Delay effect
         scaledDelaySize = int(self.delaySize * bufferLength / 100)
-        delayLine = queue.Queue(maxsize = scaledDelaySize)
-        bufferCounter = 0
 
         decay = 0.999
 
-        for i in range(0, duration):
-            current = buffer[bufferCounter]
-            if delayLine.full():
-                delayed = delayLine.get()
-                next = delayLine.queue[0]
+        # The output doubles as the string buffer and the delay line: the buffer holds the sample from bufferLength samples ago,
+        # and the delay line feeds back the two samples from scaledDelaySize samples ago.
+        samples = np.empty(duration)
+        if scaledDelaySize >= 2:
+            blockLength = min(bufferLength, scaledDelaySize - 1)
+        else:
+            blockLength = bufferLength
+
+        # Every sample only depends on samples at least one block earlier, so a whole block can be computed at once.
+        for start in range(0, duration, blockLength):
+            end = min(start + blockLength, duration)
+            current = np.empty(end - start)
+            excitationEnd = min(max(bufferLength - start, 0), end - start)
+            current[:excitationEnd] = excitation[start:start + excitationEnd]
+            current[excitationEnd:] = samples[start + excitationEnd - bufferLength:end - bufferLength]
+
+            feedbackStart = max(scaledDelaySize, start)
+            if scaledDelaySize >= 2 and feedbackStart < end:
+                delayed = samples[feedbackStart - scaledDelaySize:end - scaledDelaySize]
+                next = samples[feedbackStart - scaledDelaySize + 1:end - scaledDelaySize + 1]
                 # Low-pass filter
                 average = (delayed + next) / 2 * decay
                 # Feedback system
-                current += average
-                current /= 2
+                feedback = current[feedbackStart - start:]
+                feedback += average
+                feedback /= 2
+
+            samples[start:end] = current
 
-            samples.append(current)
-            delayLine.put(current)
-            buffer[bufferCounter] = current
+        samples = samples.astype(np.float32)
 
-            bufferCounter += 1
-            if bufferCounter >= bufferLength:
-                bufferCounter = 0
-        
         if debug:
             seconds = duration / sampleRate
             time = np.linspace(0, seconds, duration)
@@ -156,18 +379,19 @@ class AcousticGuitar(Instrument):
 
         return samples
 
-    def getNote(self, frequency, duration, sampleRate):
+    def getNote(self, frequency, duration, sampleRate, random = np.random):
         """
         Gets a note of a certain frequency.
 
         Args:
             frequency: The frequency of the note.
             duration: The duration of the note in samples.
+            random: The random number generator to synthesize the note with.
 
         Returns:
-            A list of samples representing the note.
+            An array of float32 samples representing the note.
         """
-        samples = self.getBaseStringSound(frequency, duration, sampleRate)
+        samples = self.getBaseStringSound(frequency, duration, sampleRate, random)
 
         return samples
 
@@ -178,86 +402,115 @@ class ElectricGuitar(AcousticGuitar):
         """Initializes an electric guitar instrument."""
         self.delaySize = 300
 
-    def getNote(self, frequency, duration, sampleRate):
+    def getNote(self, frequency, duration, sampleRate, random = np.random):
         """
         Gets a note of a certain frequency.
 
         Args:
             frequency: The frequency of the note.
             duration: The duration of the note in samples.
+            random: The random number generator to synthesize the note with.
 
         Returns:
-            A list of samples representing the note.
+            An array of float32 samples representing the note.
         """
-        samples = AcousticGuitar.getBaseStringSound(self, frequency, duration, sampleRate)
+        samples = AcousticGuitar.getBaseStringSound(self, frequency, duration, sampleRate, random)
 
         # Bitcrusher effect, taking advantage of quantization noise.
         crushFactor = 8
-        crushCounter = 0
-        currentIndex = 0
-        for i in range(duration):
-            samples[i] = samples[currentIndex]
-            crushCounter += 1
-            if crushCounter > crushFactor:
-                currentIndex += crushCounter
-                crushCounter = 0
+        # Hold every sample for crushFactor more samples.
+        holdLength = crushFactor + 1
+        samples = samples[np.arange(duration) // holdLength * holdLength]
 
         return samples
 
 class Trumpet(Instrument):
     """A synthesized trumpet."""
 
-    def getNote(self, frequency, duration, sampleRate):
+    # The amplitudes of the harmonics of the trumpet, starting from the fundamental.
+    envelope = [3.6, 2.825, 3, 2.688, 1.464, 1.520, 1.122, 0.940, 0.738, 0.495, 0.362, 0.237, 0.154, 0.154, 0.101, 0.082, 0.054, 0.038, 0.036]
+    # A single cycle of all the harmonics mixed together.
+    table = wavetable.Wavetable(envelope)
+    # The peak volume of the ADSR curve, reached at the end of the attack.
+    PEAK = 0.1
+    # The volume of the ADSR curve while the note is sustained.
+    SUSTAIN = PEAK * 0.8
+
+    def getNote(self, frequency, duration, sampleRate, random = np.random):
         """
         Gets a note of a certain frequency.
 
         Args:
             frequency: The frequency of the note.
             duration: The duration of the note in samples.
+            random: The random number generator to synthesize the note with.
 
         Returns:
-            A list of samples representing the note.
+            An array of samples representing the note.
         """
         seconds = duration / sampleRate
 
         # ADSR curve
         attackLength = int(0.075 * sampleRate)
-        decayLength = int(0.3 * sampleRate)
-        releaseLength = int(0.2 * sampleRate)
-        sustainLength = duration - attackLength - decayLength - releaseLength
 
         if duration < attackLength:
             return np.zeros(duration)
 
         # Additive synthesis
-        envelope = [3.6, 2.825, 3, 2.688, 1.464, 1.520, 1.122, 0.940, 0.738, 0.495, 0.362, 0.237, 0.154, 0.154, 0.101, 0.082, 0.054, 0.038, 0.036]
-
-        time = np.linspace(0, seconds, duration)
-        samples = np.zeros(duration)
-        for i, amplitude in enumerate(envelope):
-            samples += amplitude * np.sin(frequency * (i + 1) * 2 * np.pi * time)
+        if duration > 1:
+            samples = Trumpet.table.render(frequency * seconds / (duration - 1), duration)
+        else:
+            samples = np.zeros(duration)
 
         # High-pass filter
         RC = 1 / (np.pi * frequency * 32)
         alpha = RC / (RC + 1.0 / sampleRate)
-        newSamples = np.zeros(duration)
-        newSamples[0] = samples[0]
-        for i in range(1, duration):
-            newSamples[i] = alpha * (newSamples[i - 1] + samples[i] - samples[i - 1])
-        samples = newSamples
+        samples, state = filters.highPass(samples, alpha)
 
-        peak = 0.1
-        sustain = peak * 0.8
+        Trumpet.applyAdsr(samples, sampleRate)
 
-        adsr = np.linspace(0, peak, attackLength)
+        return samples
+
+    @staticmethod
+    def applyAdsr(samples, sampleRate):
+        """
+        Shapes a note with an ADSR curve.
+
+        Args:
+            samples: The samples of the note, which are changed in place. The note must be at least as long as the attack.
+            sampleRate: The sample rate of the note.
+        """
+        attack, decay, release = Trumpet.getAdsrSegments(sampleRate)
+        duration = len(samples)
+        attackLength = len(attack)
+        sustainLength = duration - attackLength - len(decay) - len(release)
+
+        samples[:attackLength] *= attack
         if sustainLength < 0:
             # Quickly fade out after attack if duration is too short for full ADSR curve.
-            adsr = np.append(adsr, np.linspace(peak, 0, duration - attackLength))
+            samples[attackLength:] *= np.linspace(Trumpet.PEAK, 0, duration - attackLength)
         else:
-            adsr = np.append(adsr, np.linspace(peak, sustain, decayLength))
-            adsr = np.append(adsr, np.full(sustainLength, sustain))
-            adsr = np.append(adsr, np.linspace(sustain, 0, releaseLength))
+            sustainEnd = attackLength + len(decay) + sustainLength
+            samples[attackLength:attackLength + len(decay)] *= decay
+            samples[attackLength + len(decay):sustainEnd] *= Trumpet.SUSTAIN
+            samples[sustainEnd:] *= release
+
+    @staticmethod
+    @functools.lru_cache(maxsize = 8)
+    def getAdsrSegments(sampleRate):
+        """
+        Gets the parts of the ADSR curve that do not depend on the length of a note.
+        The sustain is constant, so notes of any length share the same few cached arrays.
 
-        samples *= adsr
+        Args:
+            sampleRate: The sample rate to create audio for.
 
-        return samples
\ No newline at end of file
+        Returns:
+            A tuple of read-only arrays with the volume of each sample of the attack, decay and release.
+        """
+        attack = np.linspace(0, Trumpet.PEAK, int(0.075 * sampleRate))
+        decay = np.linspace(Trumpet.PEAK, Trumpet.SUSTAIN, int(0.3 * sampleRate))
+        release = np.linspace(Trumpet.SUSTAIN, 0, int(0.2 * sampleRate))
+        for segment in (attack, decay, release):
+            segment.flags.writeable = False
+        return attack, decay, release
@@ -0,0 +1,256 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+class NullSpan:
+    """A span that records nothing, used while instrumentation is disabled."""
+
+    def __enter__(self):
+        """
+        Starts the span.
+
+        Returns:
+            The span.
+        """
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        """Ends the span."""
+        return False
+
+    def setArgs(self, **args):
+        """Ignores values describing the span."""
+
+# The span returned whenever instrumentation is disabled, so disabled spans do not allocate anything.
+NULL_SPAN = NullSpan()
+
+class Span:
+    """A timed section of work."""
+
+    def __init__(self, instrumentation, name, args):
+        """
+        Initializes a span.
+
+        Args:
+            instrumentation: The instrumentation to record the span in.
+            name: The name of the span.
+            args: Values describing the span.
+        """
+        self.instrumentation = instrumentation
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        """
+        Starts timing the span.
+
+        Returns:
+            The span.
+        """
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        """Stops timing the span and records it."""
+        duration = time.perf_counter() - self.start
+        if excType is not None:
+            self.args["error"] = excType.__name__
+        self.instrumentation.addSpan(self.name, self.start, duration, self.args)
+        return False
+
+    def setArgs(self, **args):
+        """
+        Adds values describing the span, such as sizes that are only known once the work is done.
+
+        Args:
+            args: The values to add.
+        """
+        self.args.update(args)
+
+class Instrumentation:
+    """
+    Records timed spans around stages of work, counters and histograms, for finding out where time goes.
+
+    While disabled, spans and counters do nothing, so instrumented code runs at close to full speed.
+    """
+
+    def __init__(self, enabled = False):
+        """
+        Initializes instrumentation.
+
+        Args:
+            enabled: Whether to record anything.
+        """
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        # Spans are timed from when the instrumentation was created.
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self.histograms = {}
+
+    def span(self, name, **args):
+        """
+        Creates a span to time a stage of work with a with statement.
+
+        Args:
+            name: The name of the stage.
+            args: Values describing the stage.
+
+        Returns:
+            The span.
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def addSpan(self, name, start, duration, args):
+        """
+        Records a finished span.
+
+        Args:
+            name: The name of the span.
+            start: The performance counter time the span started at.
+            duration: The duration of the span in seconds.
+            args: Values describing the span.
+        """
+        with self.lock:
+            self.spans.append({"name": name, "start": start - self.origin, "duration": duration, "thread": threading.get_ident(), "args": args})
+
+    def count(self, name, amount = 1):
+        """
+        Adds to a counter.
+
+        Args:
+            name: The name of the counter.
+            amount: The amount to add.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def addHistogram(self, name, bounds):
+        """
+        Creates a histogram if it does not exist yet.
+
+        Args:
+            name: The name of the histogram.
+            bounds: The increasing upper bounds of the bins. Values above the last bound go into an extra bin.
+        """
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = {"bounds": list(bounds), "counts": [0] * (len(bounds) + 1)}
+
+    def observe(self, name, value):
+        """
+        Adds a value to a histogram created with addHistogram.
+
+        Args:
+            name: The name of the histogram.
+            value: The value to add.
+        """
+        if not self.enabled:
+            return
+        histogram = self.histograms[name]
+        index = bisect.bisect_left(histogram["bounds"], value)
+        with self.lock:
+            histogram["counts"][index] += 1
+
+    def getSpans(self, name = None):
+        """
+        Gets the recorded spans.
+
+        Args:
+            name: The name of the spans to get, or None to get every span.
+
+        Returns:
+            A list of dictionaries with the name, start and duration in seconds, thread and values of each span.
+        """
+        with self.lock:
+            return [span for span in self.spans if name is None or span["name"] == name]
+
+    def getCounter(self, name):
+        """
+        Gets the value of a counter.
+
+        Args:
+            name: The name of the counter.
+
+        Returns:
+            The value of the counter, or 0 if nothing was counted.
+        """
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def getSummary(self):
+        """
+        Summarizes the spans by name.
+
+        Returns:
+            A dictionary with the number of spans and their total and longest duration in seconds, by span name.
+        """
+        summary = {}
+        for span in self.getSpans():
+            stage = summary.setdefault(span["name"], {"count": 0, "total": 0.0, "max": 0.0})
+            stage["count"] += 1
+            stage["total"] += span["duration"]
+            stage["max"] = max(stage["max"], span["duration"])
+        return summary
+
+    def getReport(self):
+        """
+        Gets everything that has been recorded.
+
+        Returns:
+            A dictionary with the spans, span summary, counters and histograms.
+        """
+        with self.lock:
+            histograms = {name: {"bounds": histogram["bounds"], "counts": list(histogram["counts"])} for name, histogram in self.histograms.items()}
+            counters = dict(self.counters)
+        return {"spans": self.getSpans(), "summary": self.getSummary(), "counters": counters, "histograms": histograms}
+
+    def exportJson(self, filePath):
+        """
+        Writes everything that has been recorded to a JSON file.
+
+        Args:
+            filePath: The file path to write to.
+        """
+        with open(filePath, "w") as outputFile:
+            json.dump(self.getReport(), outputFile, indent = 2, default = str)
+
+    def exportChromeTrace(self, filePath):
+        """
+        Writes the spans and counters to a file in the Chrome trace event format, which chrome://tracing and Perfetto can open.
+
+        Args:
+            filePath: The file path to write to.
+        """
+        processId = os.getpid()
+        events = []
+        end = 0.0
+        for span in self.getSpans():
+            events.append({"name": span["name"], "ph": "X", "ts": span["start"] * 1e6, "dur": span["duration"] * 1e6, "pid": processId, "tid": span["thread"], "args": span["args"]})
+            end = max(end, span["start"] + span["duration"])
+        with self.lock:
+            counters = dict(self.counters)
+        for name, value in counters.items():
+            events.append({"name": name, "ph": "C", "ts": end * 1e6, "pid": processId, "args": {name: value}})
+        with open(filePath, "w") as outputFile:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, outputFile, default = str)
+
+    def reset(self):
+        """Discards everything that has been recorded."""
+        with self.lock:
+            self.origin = time.perf_counter()
+            self.spans = []
+            self.counters = {}
+            for histogram in self.histograms.values():
+                histogram["counts"] = [0] * len(histogram["counts"])
+
+# Instrumentation that never records anything, for code that is run without any.
+DISABLED = Instrumentation()
@@ -0,0 +1,79 @@
+import threading
+
+class JobCancelled(Exception):
+    """Raised inside a job to stop it once it has been cancelled."""
+
+class Job:
+    """A task running in the background that reports which stage it is in and can be cancelled."""
+
+    # The stages that a job can go through, in order.
+    STAGES = ["load", "detect", "post-process", "synthesize", "write"]
+
+    # The states that a job can be in.
+    RUNNING = "running"
+    DONE = "done"
+    CANCELLED = "cancelled"
+    FAILED = "failed"
+
+    def __init__(self):
+        """Initializes a job."""
+        self.lock = threading.Lock()
+        self.state = Job.RUNNING
+        self.stage = None
+        self.progress = 0.0
+        self.cancelled = False
+        self.error = None
+
+    def cancel(self):
+        """Asks the job to stop at its next progress report."""
+        with self.lock:
+            self.cancelled = True
+
+    def setProgress(self, stage, progress = 0.0):
+        """
+        Reports the progress of the job.
+
+        Args:
+            stage: The stage that the job is in.
+            progress: The fraction [0,1] of the stage that is done.
+
+        Raises:
+            JobCancelled: If the job has been cancelled.
+        """
+        with self.lock:
+            if self.cancelled:
+                raise JobCancelled()
+            self.stage = stage
+            self.progress = progress
+
+    def finish(self, state, error = None):
+        """
+        Marks the job as finished.
+
+        Args:
+            state: The final state of the job.
+            error: The exception that stopped the job, if it failed.
+        """
+        with self.lock:
+            self.state = state
+            self.error = error
+
+    def getStatus(self):
+        """
+        Gets the status of the job.
+
+        Returns:
+            A tuple of the state of the job, the stage it is in and the fraction [0,1] of the stage that is done.
+        """
+        with self.lock:
+            return self.state, self.stage, self.progress
+
+    def isFinished(self):
+        """
+        Checks whether the job has stopped running.
+
+        Returns:
+            Whether the job is done, cancelled or failed.
+        """
+        with self.lock:
+            return self.state != Job.RUNNING
@@ -0,0 +1,53 @@
+import importlib
+import threading
+
+class LazyModule:
+    """A module that is only imported when one of its attributes is first used."""
+
+    def __init__(self, name, setup = None):
+        """
+        Initializes a lazy module.
+
+        Args:
+            name: The full name of the module.
+            setup: A function to call before the module is imported, or None.
+        """
+        self.name = name
+        self.setup = setup
+        self.module = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Imports the module if it has not been imported yet.
+
+        Returns:
+            The imported module.
+        """
+        with self.lock:
+            if self.module is None:
+                if self.setup:
+                    self.setup()
+                self.module = importlib.import_module(self.name)
+            return self.module
+
+    def __getattr__(self, name):
+        """
+        Gets an attribute of the module, importing it first if necessary.
+
+        Args:
+            name: The name of the attribute.
+
+        Returns:
+            The attribute of the module.
+        """
+        # Only called for attributes that are not set on the lazy module itself.
+        return getattr(self.load(), name)
+
+def useTkBackend():
+    """Makes matplotlib plot in Tk windows, which must be chosen before pyplot is imported."""
+    import matplotlib
+    matplotlib.use("TkAgg")
+
+# Pyplot, which is only needed for debug plots, with the backend used by the GUI.
+plt = LazyModule("matplotlib.pylab", useTkBackend)
@@ -0,0 +1,237 @@
+import struct
+
+import numpy as np
+
+# WAV format codes of sample data that can be mapped.
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+class MappedAudio:
+    """
+    Uncompressed audio samples mapped from a file instead of read into memory.
+
+    Slicing the frames converts just those frames to float32, scaled like soundfile reads them, so the operating system
+    only pages in the parts of the file that are used.
+    """
+
+    def __init__(self, filePath, offset, frames, channels, sampleRate, sampleSize, isFloat, bigEndian):
+        """
+        Initializes mapped audio.
+
+        Args:
+            filePath: The file path of the audio file.
+            offset: The byte offset of the first frame in the file.
+            frames: The number of frames in the file.
+            channels: The number of channels in each frame.
+            sampleRate: The sample rate of the audio.
+            sampleSize: The number of bytes in each sample.
+            isFloat: Whether the samples are floating point instead of signed integers.
+            bigEndian: Whether the bytes of each sample are stored most significant first.
+        """
+        self.filePath = filePath
+        self.channels = channels
+        self.sampleRate = sampleRate
+        self.sampleSize = sampleSize
+        self.bigEndian = bigEndian
+        byteOrder = ">" if bigEndian else "<"
+        if sampleSize == 3:
+            # There is no 24-bit type, so the bytes of each sample are combined when they are converted.
+            self.data = np.memmap(filePath, dtype = np.uint8, mode = "r", offset = offset, shape = (frames, channels, 3))
+            self.scale = 1 / 2 ** 31
+        elif isFloat:
+            self.data = np.memmap(filePath, dtype = byteOrder + "f" + str(sampleSize), mode = "r", offset = offset, shape = (frames, channels))
+            self.scale = 1
+        elif sampleSize == 1 and not bigEndian:
+            # 8-bit WAV samples are unsigned.
+            self.data = np.memmap(filePath, dtype = np.uint8, mode = "r", offset = offset, shape = (frames, channels))
+            self.scale = 1 / 2 ** 7
+        else:
+            self.data = np.memmap(filePath, dtype = byteOrder + "i" + str(sampleSize), mode = "r", offset = offset, shape = (frames, channels))
+            self.scale = 1 / 2 ** (8 * sampleSize - 1)
+        self.length = frames
+
+    @property
+    def shape(self):
+        """The shape of the array that the frames would have if they were read into memory."""
+        if self.channels > 1:
+            return (self.length, self.channels)
+        return (self.length,)
+
+    def __len__(self):
+        """
+        Gets the number of frames in the audio.
+
+        Returns:
+            The number of frames.
+        """
+        return self.length
+
+    def __getitem__(self, key):
+        """
+        Converts frames of the audio to float32.
+
+        Args:
+            key: A slice of frames.
+
+        Returns:
+            A float32 array of the frames, with a column for each channel if there is more than one.
+        """
+        data = self.data
+        if data is None:
+            raise ValueError("The audio file has been closed.")
+        raw = data[key]
+        if self.sampleSize == 3:
+            values = raw.astype(np.int32)
+            if self.bigEndian:
+                values = (values[..., 0] << 24) | (values[..., 1] << 16) | (values[..., 2] << 8)
+            else:
+                values = (values[..., 2] << 24) | (values[..., 1] << 16) | (values[..., 0] << 8)
+            samples = values.astype(np.float32)
+        else:
+            samples = raw.astype(np.float32)
+            if raw.dtype == np.uint8:
+                samples -= 128
+        if self.scale != 1:
+            samples *= self.scale
+        if self.channels == 1:
+            return samples[:, 0]
+        return samples
+
+    def __array__(self, dtype = None, copy = None):
+        """
+        Converts all of the frames, for code that needs the whole audio in memory.
+
+        Returns:
+            A float32 array of every frame.
+        """
+        samples = self[:]
+        if dtype is not None:
+            return samples.astype(dtype)
+        return samples
+
+    def close(self):
+        """Releases the mapping. It is unmapped once the last converted block that uses it is gone."""
+        self.data = None
+
+def openMappedAudio(filePath):
+    """
+    Maps the samples of an uncompressed WAV or AIFF file.
+
+    Args:
+        filePath: The file path of the audio file.
+
+    Returns:
+        The mapped audio, or None if the file is not an uncompressed WAV or AIFF file with samples that can be mapped.
+    """
+    with open(filePath, "rb") as audioFile:
+        header = audioFile.read(12)
+        if len(header) < 12:
+            return None
+        if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+            layout = readWaveLayout(audioFile)
+        elif header[:4] == b"FORM" and header[8:12] == b"AIFF":
+            layout = readAiffLayout(audioFile)
+        else:
+            return None
+        audioFile.seek(0, 2)
+        fileSize = audioFile.tell()
+    if layout is None:
+        return None
+
+    offset, dataSize, channels, sampleRate, sampleSize, isFloat, bigEndian = layout
+    if channels < 1 or sampleSize not in (1, 2, 3, 4, 8) or (isFloat and sampleSize not in (4, 8)):
+        return None
+    # Files written while recording may have a data size that was never filled in, so the size is limited to the file.
+    dataSize = min(dataSize, fileSize - offset)
+    frames = dataSize // (channels * sampleSize)
+    if frames <= 0:
+        return None
+    return MappedAudio(filePath, offset, frames, channels, sampleRate, sampleSize, isFloat, bigEndian)
+
+def readWaveLayout(audioFile):
+    """
+    Finds the sample data of a WAV file.
+
+    Args:
+        audioFile: The WAV file, positioned after its RIFF header.
+
+    Returns:
+        A tuple of the offset and size in bytes of the sample data, the number of channels, the sample rate,
+        the number of bytes per sample, whether the samples are floating point and whether they are big-endian,
+        or None if the samples cannot be mapped.
+    """
+    formatInfo = None
+    for chunkId, chunkStart, chunkSize in readChunks(audioFile, "<"):
+        if chunkId == b"fmt ":
+            audioFile.seek(chunkStart)
+            formatData = audioFile.read(chunkSize)
+            if len(formatData) < 16:
+                return None
+            formatCode, channels, sampleRate, byteRate, blockAlign, bits = struct.unpack("<HHIIHH", formatData[:16])
+            if formatCode == WAVE_FORMAT_EXTENSIBLE and len(formatData) >= 26:
+                formatCode = struct.unpack("<H", formatData[24:26])[0]
+            if formatCode not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT) or bits % 8 or blockAlign != channels * bits // 8:
+                return None
+            formatInfo = (channels, sampleRate, bits // 8, formatCode == WAVE_FORMAT_IEEE_FLOAT, False)
+        elif chunkId == b"data":
+            if formatInfo is None:
+                return None
+            return (chunkStart, chunkSize) + formatInfo
+    return None
+
+def readAiffLayout(audioFile):
+    """
+    Finds the sample data of an AIFF file.
+
+    Args:
+        audioFile: The AIFF file, positioned after its FORM header.
+
+    Returns:
+        A tuple of the offset and size in bytes of the sample data, the number of channels, the sample rate,
+        the number of bytes per sample, whether the samples are floating point and whether they are big-endian,
+        or None if the samples cannot be mapped.
+    """
+    formatInfo = None
+    for chunkId, chunkStart, chunkSize in readChunks(audioFile, ">"):
+        if chunkId == b"COMM":
+            audioFile.seek(chunkStart)
+            commonData = audioFile.read(18)
+            if len(commonData) < 18:
+                return None
+            channels, frames, bits = struct.unpack(">hIh", commonData[:8])
+            # The sample rate is an 80-bit extended precision float.
+            exponent, mantissa = struct.unpack(">HQ", commonData[8:18])
+            sampleRate = int(round(mantissa * 2.0 ** ((exponent & 0x7FFF) - 16383 - 63)))
+            if bits % 8:
+                return None
+            formatInfo = (channels, sampleRate, bits // 8, False, True)
+        elif chunkId == b"SSND":
+            if formatInfo is None:
+                return None
+            audioFile.seek(chunkStart)
+            dataOffset = struct.unpack(">I", audioFile.read(4))[0]
+            return (chunkStart + 8 + dataOffset, chunkSize - 8 - dataOffset) + formatInfo
+    return None
+
+def readChunks(audioFile, byteOrder):
+    """
+    Reads the headers of the chunks in a RIFF or IFF file.
+
+    Args:
+        audioFile: The file, positioned at its first chunk.
+        byteOrder: "<" if chunk sizes are little-endian, ">" if they are big-endian.
+
+    Yields:
+        A tuple of the ID, offset of the data and size in bytes of each chunk.
+    """
+    while True:
+        chunkHeader = audioFile.read(8)
+        if len(chunkHeader) < 8:
+            return
+        chunkId = chunkHeader[:4]
+        chunkSize = struct.unpack(byteOrder + "I", chunkHeader[4:])[0]
+        chunkStart = audioFile.tell()
+        yield chunkId, chunkStart, chunkSize
+        # Chunks are padded to an even number of bytes.
+        audioFile.seek(chunkStart + chunkSize + chunkSize % 2)
@@ -0,0 +1,241 @@
+import numpy as np
+
+import audioprocessor
+
+class NoteArray:
+    """A sequence of notes stored as parallel arrays."""
+
+    def __init__(self, midi = None, duration = None, volume = None):
+        """
+        Initializes a note array.
+
+        Args:
+            midi: The MIDI number of each note, or 0 for silence.
+            duration: The duration of each note in samples.
+            volume: The volume [0,1] of each note. Defaults to 1 for every note.
+        """
+        if midi is None:
+            midi = []
+        if duration is None:
+            duration = []
+        self.midi = np.array(midi, dtype = np.int64)
+        self.duration = np.array(duration, dtype = np.int64)
+        if volume is None:
+            self.volume = np.ones(len(self.midi), dtype = np.float32)
+        else:
+            self.volume = np.array(volume, dtype = np.float32)
+
+    @staticmethod
+    def fromFrequencies(frequencies, durations):
+        """
+        Creates notes from detected frequencies, rounding each frequency to the nearest semitone.
+
+        Args:
+            frequencies: The frequency of each note. Frequencies of 0 or less become silence.
+            durations: The duration of each note in samples.
+
+        Returns:
+            The created notes.
+        """
+        frequencies = np.asarray(frequencies, dtype = np.float64)
+        midi = np.zeros(len(frequencies), dtype = np.int64)
+        pitched = frequencies > 0
+        midi[pitched] = np.round(69 + 12 * (np.log(frequencies[pitched] / 440) / np.log(2)))
+        return NoteArray(midi, durations)
+
+    @staticmethod
+    def fromNotes(notes):
+        """
+        Creates a note array from a list of notes.
+
+        Args:
+            notes: A list of Note objects, or a note array.
+
+        Returns:
+            A note array containing the notes.
+        """
+        if isinstance(notes, NoteArray):
+            return notes
+        return NoteArray([note.midi for note in notes], [note.duration for note in notes], [note.volume for note in notes])
+
+    @staticmethod
+    def concatenate(noteArrays):
+        """
+        Joins note arrays end to end without merging them.
+
+        Args:
+            noteArrays: The note arrays to join.
+
+        Returns:
+            A note array containing all the notes in order.
+        """
+        noteArrays = list(noteArrays)
+        if not noteArrays:
+            return NoteArray()
+        return NoteArray(np.concatenate([notes.midi for notes in noteArrays]), np.concatenate([notes.duration for notes in noteArrays]), np.concatenate([notes.volume for notes in noteArrays]))
+
+    @property
+    def frequency(self):
+        """The frequency of each note rounded to its semitone, or 0 for silence."""
+        frequencies = 2 ** ((self.midi - 69) / 12) * 440
+        frequencies[self.midi == 0] = 0
+        return frequencies
+
+    def toNotes(self):
+        """
+        Converts the note array into a list of notes.
+
+        Returns:
+            A list of Note objects.
+        """
+        notes = []
+        for midi, duration, volume in zip(self.midi.tolist(), self.duration.tolist(), self.volume):
+            note = audioprocessor.Note(0, duration)
+            note.midi = midi
+            if midi != 0:
+                note.frequency = 2 ** ((midi - 69) / 12) * 440
+            note.volume = volume
+            notes.append(note)
+        return notes
+
+    def copy(self):
+        """
+        Copies the notes.
+
+        Returns:
+            A new note array with its own copy of each array.
+        """
+        return NoteArray(self.midi, self.duration, self.volume)
+
+    def setZero(self, mask):
+        """
+        Sets notes to silence.
+
+        Args:
+            mask: A boolean array selecting the notes to silence.
+        """
+        self.midi[mask] = 0
+        self.volume[mask] = 0
+
+    def merge(self):
+        """
+        Merges consecutive notes with the same pitch, after silencing notes out of the audio processor's range.
+
+        Merged notes keep the volume of the first note in the run.
+
+        Returns:
+            The index of the first original note of each merged note.
+        """
+        self.setZero(~audioprocessor.AudioProcessor.isNoteInRange(self.frequency))
+        if len(self.midi) == 0:
+            return np.zeros(0, dtype = np.int64)
+        runStarts = np.flatnonzero(np.diff(self.midi, prepend = self.midi[0] - 1))
+        self.duration = np.add.reduceat(self.duration, runStarts)
+        self.midi = self.midi[runStarts]
+        self.volume = self.volume[runStarts]
+        return runStarts
+
+    def __len__(self):
+        """
+        Gets the number of notes.
+
+        Returns:
+            The number of notes.
+        """
+        return len(self.midi)
+
+    def __getitem__(self, index):
+        """
+        Gets a view of a single note.
+
+        Args:
+            index: The index of the note.
+
+        Returns:
+            A NoteView of the note.
+        """
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("note index out of range")
+        return NoteView(self, index)
+
+    def __iter__(self):
+        """
+        Iterates over views of the notes.
+
+        Returns:
+            An iterator of NoteView objects.
+        """
+        for index in range(len(self)):
+            yield NoteView(self, index)
+
+    def __repr__(self):
+        """
+        Converts the notes into a string.
+
+        Returns:
+            The string representation of the notes.
+        """
+        return "[" + ", ".join(repr(note) for note in self) + "]"
+
+class NoteView:
+    """A single note of a note array, with the same attributes as a Note."""
+
+    __slots__ = ("notes", "index")
+
+    def __init__(self, notes, index):
+        """
+        Initializes a note view.
+
+        Args:
+            notes: The note array containing the note.
+            index: The index of the note in the array.
+        """
+        self.notes = notes
+        self.index = index
+
+    @property
+    def midi(self):
+        """The MIDI number of the note, or 0 for silence."""
+        return int(self.notes.midi[self.index])
+
+    @property
+    def frequency(self):
+        """The frequency of the note rounded to its semitone, or 0 for silence."""
+        midi = self.midi
+        if midi == 0:
+            return 0
+        return 2 ** ((midi - 69) / 12) * 440
+
+    @property
+    def duration(self):
+        """The duration of the note in samples."""
+        return int(self.notes.duration[self.index])
+
+    @duration.setter
+    def duration(self, duration):
+        self.notes.duration[self.index] = duration
+
+    @property
+    def volume(self):
+        """The volume [0,1] of the note."""
+        return self.notes.volume[self.index]
+
+    @volume.setter
+    def volume(self, volume):
+        self.notes.volume[self.index] = volume
+
+    def setZero(self):
+        """Sets the frequency of the note to 0."""
+        self.notes.midi[self.index] = 0
+        self.notes.volume[self.index] = 0
+
+    def __repr__(self):
+        """
+        Converts the note into a string.
+
+        Returns:
+            The string representation of the note.
+        """
+        return "(" + str(self.frequency) + ", " + str(self.duration) + ")"
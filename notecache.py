@@ -0,0 +1,110 @@
+import collections
+import threading
+import zlib
+
+class NoteCache:
+    """A least-recently-used cache of synthesized notes, limited by the memory used by the cached samples."""
+
+    def __init__(self, maxBytes, seeded = False):
+        """
+        Initializes a note cache.
+
+        Args:
+            maxBytes: The maximum number of bytes of samples to keep in the cache.
+            seeded: Whether notes should be rendered with a random seed derived from their key,
+                so that cached notes are the same as freshly rendered ones.
+        """
+        self.maxBytes = maxBytes
+        self.seeded = seeded
+        self.notes = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.currentBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Gets a cached note, marking it as the most recently used.
+
+        Args:
+            key: The key of the note.
+
+        Returns:
+            The samples of the note, or None if the note is not cached.
+        """
+        with self.lock:
+            samples = self.notes.get(key)
+            if samples is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.notes.move_to_end(key)
+            return samples
+
+    def put(self, key, samples):
+        """
+        Adds a note to the cache, evicting the least recently used notes if the cache is full.
+
+        Args:
+            key: The key of the note.
+            samples: The samples of the note. They are made read-only, since they are shared by every use of the note.
+        """
+        if samples.nbytes > self.maxBytes:
+            return
+        samples.flags.writeable = False
+        with self.lock:
+            if key in self.notes:
+                self.currentBytes -= self.notes.pop(key).nbytes
+            self.notes[key] = samples
+            self.currentBytes += samples.nbytes
+            while self.currentBytes > self.maxBytes:
+                evictedKey, evicted = self.notes.popitem(last = False)
+                self.currentBytes -= evicted.nbytes
+                self.evictions += 1
+
+    def getSeed(self, key):
+        """
+        Gets the random seed to render a note with.
+
+        Args:
+            key: The key of the note.
+
+        Returns:
+            A seed that is the same for the same key in every process.
+        """
+        return zlib.crc32(repr(key).encode())
+
+    def clear(self):
+        """Removes every note from the cache."""
+        with self.lock:
+            self.notes.clear()
+            self.currentBytes = 0
+
+    def __getstate__(self):
+        """
+        Gets the state of the cache to copy it to another process. Cached notes are not copied.
+
+        Returns:
+            The settings of the cache.
+        """
+        return {"maxBytes": self.maxBytes, "seeded": self.seeded}
+
+    def __setstate__(self, state):
+        """
+        Restores a cache copied from another process as an empty cache.
+
+        Args:
+            state: The settings of the cache.
+        """
+        self.__init__(state["maxBytes"], state["seeded"])
+
+    def getStats(self):
+        """
+        Gets usage statistics of the cache.
+
+        Returns:
+            A dictionary with the number of hits, misses and evictions, and the number of notes and bytes in the cache.
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "notes": len(self.notes), "bytes": self.currentBytes}
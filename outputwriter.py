@@ -0,0 +1,336 @@
+import collections
+import threading
+
+import soundfile as sf
+
+import instrumentation
+
+class OutputWriter:
+    """
+    Writes output files on a background thread, so that processing never waits for the disk.
+
+    Audio is written a block at a time through an open sound file, in the format given by the file extension
+    (for example .wav, .flac or .ogg), either from a finished array or from blocks queued through an AudioStream
+    as they are produced. A file that is written again before an earlier write of it has finished stops the
+    earlier write, since its contents would be replaced anyway, and the data queued for the earlier write is dropped.
+    """
+
+    # The number of frames written to a sound file at a time.
+    BLOCK_SIZE = 65536
+    # The number of bytes of data that can wait for the writer thread before new writes wait for space.
+    # A single write larger than this is still queued once nothing else is waiting. Views of other arrays are not counted.
+    QUEUE_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, instrumentation = instrumentation.DISABLED):
+        """
+        Initializes an output writer.
+
+        Args:
+            instrumentation: The instrumentation to record the time spent writing in.
+        """
+        self.instrumentation = instrumentation
+        self.condition = threading.Condition()
+        # The queued writes, as (task, filePath, generation, args, size) tuples, with None to stop the writer thread.
+        self.queue = collections.deque()
+        # The number of bytes of data held by the queued writes.
+        self.queuedBytes = 0
+        # The number of queued writes that have not finished yet, including the one being written.
+        self.unfinished = 0
+        # The number of times each file path has been opened for writing, so that a write can tell when it has been replaced.
+        self.generations = {}
+        # The sound files opened by AudioStreams, by file path, with the generation they were opened for.
+        self.soundFiles = {}
+        # The exception raised by the last failed write, reported by flush.
+        self.error = None
+        self.thread = None
+
+    def writeAudio(self, filePath, samples, sampleRate):
+        """
+        Queues audio to be written to a sound file.
+
+        Args:
+            filePath: The file path to write to, or None to not write the audio.
+            samples: The samples to write, with a column for each channel if there is more than one. They must not be modified afterwards.
+            sampleRate: The sample rate of the samples.
+        """
+        if filePath:
+            generation = self.startFile(filePath)
+            self.submit(filePath, generation, self.saveAudio, samples.nbytes, samples, sampleRate)
+
+    def openAudio(self, filePath, sampleRate, channels):
+        """
+        Starts writing a sound file whose samples are queued a block at a time as they are produced.
+
+        Args:
+            filePath: The file path to write to, or None to not write the audio.
+            sampleRate: The sample rate of the samples.
+            channels: The number of channels of the samples.
+
+        Returns:
+            The AudioStream to queue the samples with.
+        """
+        generation = None
+        if filePath:
+            generation = self.startFile(filePath)
+            self.submit(filePath, generation, self.openSoundFile, 0, sampleRate, channels)
+        return AudioStream(self, filePath, generation)
+
+    def writeMidi(self, filePath, midiFile):
+        """
+        Queues a MIDI file to be written.
+
+        Args:
+            filePath: The file path to write to, or None to not write the MIDI file.
+            midiFile: The MIDIFile to write. It must not be modified afterwards.
+        """
+        if filePath:
+            generation = self.startFile(filePath)
+            self.submit(filePath, generation, self.saveMidi, 0, midiFile)
+
+    def startFile(self, filePath):
+        """
+        Starts a new write of a file, dropping the queued data of earlier writes of it.
+
+        Args:
+            filePath: The file path to write to.
+
+        Returns:
+            The generation of the new write.
+        """
+        with self.condition:
+            generation = self.generations.get(filePath, 0) + 1
+            self.generations[filePath] = generation
+            superseded = [item for item in self.queue if item is not None and item[1] == filePath]
+            for item in superseded:
+                self.queue.remove(item)
+                self.queuedBytes -= item[4]
+                self.unfinished -= 1
+            if superseded:
+                self.condition.notify_all()
+            return generation
+
+    def submit(self, filePath, generation, task, size, *args):
+        """
+        Queues a write for the writer thread, waiting until the queue has space for its data.
+
+        Args:
+            filePath: The file path to write to.
+            generation: The generation of the write, from startFile.
+            task: The method that writes the file.
+            size: The number of bytes of data held by the arguments.
+            args: The arguments to the method after the file path and generation.
+        """
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target = self.run, daemon = True)
+                self.thread.start()
+            while self.queuedBytes > 0 and self.queuedBytes + size > OutputWriter.QUEUE_BYTES and self.generations.get(filePath) == generation:
+                self.condition.wait()
+            if self.generations.get(filePath) != generation:
+                return
+            self.queue.append((task, filePath, generation, args, size))
+            self.queuedBytes += size
+            self.unfinished += 1
+            self.condition.notify_all()
+
+    def isCurrent(self, filePath, generation):
+        """
+        Checks whether a write is the latest one queued for its file.
+
+        Args:
+            filePath: The file path of the write.
+            generation: The generation of the write.
+
+        Returns:
+            Whether no later write of the file has been queued.
+        """
+        with self.condition:
+            return self.generations.get(filePath) == generation
+
+    def run(self):
+        """Writes queued files until the writer is closed."""
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                item = self.queue.popleft()
+                if item is None:
+                    return
+                task, filePath, generation, args, size = item
+            try:
+                if self.isCurrent(filePath, generation):
+                    task(filePath, generation, *args)
+                else:
+                    self.closeSoundFile(filePath, generation)
+            except Exception as error:
+                self.error = error
+            finally:
+                with self.condition:
+                    self.queuedBytes -= size
+                    self.unfinished -= 1
+                    self.condition.notify_all()
+
+    def saveAudio(self, filePath, generation, samples, sampleRate):
+        """
+        Writes audio to a sound file a block at a time, stopping early if a later write of the file has been queued.
+
+        Args:
+            filePath: The file path to write to.
+            generation: The generation of the write.
+            samples: The samples to write.
+            sampleRate: The sample rate of the samples.
+        """
+        self.closeSoundFile(filePath)
+        channels = samples.shape[1] if samples.ndim > 1 else 1
+        with self.instrumentation.span("write audio", file = filePath), sf.SoundFile(filePath, "w", sampleRate, channels) as soundFile:
+            for start in range(0, len(samples), OutputWriter.BLOCK_SIZE):
+                if not self.isCurrent(filePath, generation):
+                    return
+                block = samples[start:start + OutputWriter.BLOCK_SIZE]
+                soundFile.write(block)
+                self.instrumentation.count("samples written", block.size)
+
+    def openSoundFile(self, filePath, generation, sampleRate, channels):
+        """
+        Opens a sound file for the blocks of an AudioStream.
+
+        Args:
+            filePath: The file path to write to.
+            generation: The generation of the write.
+            sampleRate: The sample rate of the samples.
+            channels: The number of channels of the samples.
+        """
+        self.closeSoundFile(filePath)
+        self.soundFiles[filePath] = (generation, sf.SoundFile(filePath, "w", sampleRate, channels))
+
+    def saveAudioBlock(self, filePath, generation, samples):
+        """
+        Writes a block of an AudioStream to its sound file.
+
+        Args:
+            filePath: The file path to write to.
+            generation: The generation of the write.
+            samples: The samples to write.
+        """
+        openGeneration, soundFile = self.soundFiles.get(filePath, (None, None))
+        if openGeneration != generation:
+            return
+        with self.instrumentation.span("write audio", file = filePath):
+            for start in range(0, len(samples), OutputWriter.BLOCK_SIZE):
+                block = samples[start:start + OutputWriter.BLOCK_SIZE]
+                soundFile.write(block)
+                self.instrumentation.count("samples written", block.size)
+
+    def closeSoundFile(self, filePath, generation = None):
+        """
+        Closes the sound file opened for an AudioStream.
+
+        Args:
+            filePath: The file path of the sound file.
+            generation: The generation of the write to close, or None to close the file whichever write opened it.
+        """
+        openGeneration, soundFile = self.soundFiles.get(filePath, (None, None))
+        if soundFile and generation in (None, openGeneration):
+            del self.soundFiles[filePath]
+            soundFile.close()
+
+    def saveMidi(self, filePath, generation, midiFile):
+        """
+        Writes a MIDI file.
+
+        Args:
+            filePath: The file path to write to.
+            generation: The generation of the write.
+            midiFile: The MIDIFile to write.
+        """
+        with self.instrumentation.span("write MIDI", file = filePath), open(filePath, "wb") as outputFile:
+            midiFile.writeFile(outputFile)
+
+    def flush(self):
+        """
+        Waits for every queued write to finish.
+
+        Raises:
+            Exception: The error of a write that failed since the last flush.
+        """
+        with self.condition:
+            while self.unfinished:
+                self.condition.wait()
+        error = self.error
+        self.error = None
+        if error:
+            raise error
+
+    def close(self):
+        """
+        Finishes the queued writes and stops the writer thread.
+
+        Raises:
+            Exception: The error of a write that failed since the last flush.
+        """
+        if self.thread:
+            with self.condition:
+                self.queue.append(None)
+                self.condition.notify_all()
+            self.thread.join()
+            self.thread = None
+        for filePath in list(self.soundFiles):
+            self.closeSoundFile(filePath)
+        error = self.error
+        self.error = None
+        if error:
+            raise error
+
+class AudioStream:
+    """
+    Queues the samples of a sound file to an OutputWriter a block at a time, as they are produced.
+
+    Streams are made by OutputWriter.openAudio. Once a later write of the same file has been queued,
+    writing to the stream does nothing.
+    """
+
+    def __init__(self, writer, filePath, generation):
+        """
+        Initializes an audio stream.
+
+        Args:
+            writer: The OutputWriter that writes the samples.
+            filePath: The file path to write to, or None to not write the audio.
+            generation: The generation of the write.
+        """
+        self.writer = writer
+        self.filePath = filePath
+        self.generation = generation
+
+    def __enter__(self):
+        """
+        Returns the stream, so that it is closed at the end of a with statement.
+
+        Returns:
+            The stream.
+        """
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        """Closes the stream."""
+        self.close()
+        return False
+
+    def write(self, samples):
+        """
+        Queues the next samples of the sound file, waiting if the writer's queue is full of samples that it alone holds.
+
+        Args:
+            samples: The samples to write, with a column for each channel if there is more than one. They must not be modified afterwards.
+        """
+        if self.filePath and len(samples):
+            # A view of a larger array, such as a block of a track that is still being synthesized, is kept in memory by that
+            # array anyway, so waiting for space would only hold back synthesis behind the disk.
+            size = samples.nbytes if samples.base is None else 0
+            self.writer.submit(self.filePath, self.generation, self.writer.saveAudioBlock, size, samples)
+
+    def close(self):
+        """Queues the sound file to be closed once its samples are written."""
+        if self.filePath:
+            self.writer.submit(self.filePath, self.generation, self.writer.closeSoundFile, 0)
+            self.filePath = None
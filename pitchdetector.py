@@ -0,0 +1,305 @@
+import numpy as np
+
+import lazyimport
+
+fft = lazyimport.LazyModule("scipy.fft")
+
+# The number of frames to autocorrelate in a single FFT pass.
+BATCH_FRAMES = 256
+
+def frameSignal(samples, frameLength, hopLength = None):
+    """
+    Splits a single channel of samples into frames starting every hopLength samples, which overlap if the hop is shorter than a frame.
+
+    Args:
+        samples: The samples of a single channel.
+        frameLength: The length of each frame in samples.
+        hopLength: The number of samples between the starts of consecutive frames. Defaults to the frame length.
+
+    Returns:
+        A strided view of the samples with one full frame per row, without copying them. Frames that would run past the end are left out.
+    """
+    if not hopLength:
+        hopLength = frameLength
+    if len(samples) < frameLength:
+        return np.zeros((0, frameLength), dtype = samples.dtype)
+    numFrames = (len(samples) - frameLength) // hopLength + 1
+    return np.lib.stride_tricks.sliding_window_view(samples[:(numFrames - 1) * hopLength + frameLength], frameLength)[::hopLength]
+
+def autocorrelate(frames):
+    """
+    Computes the autocorrelation of every frame in a single FFT pass.
+
+    Args:
+        frames: A 2D array with one frame per row.
+
+    Returns:
+        A 2D array containing the non-negative lags of each frame's autocorrelation.
+    """
+    frameLength = frames.shape[1]
+    fftLength = fft.next_fast_len(2 * frameLength - 1, True)
+    spectrum = fft.rfft(frames, fftLength, axis = 1)
+    power = spectrum.real ** 2 + spectrum.imag ** 2
+    return fft.irfft(power, fftLength, axis = 1)[:, :frameLength]
+
+def findPeakLags(autocorrelation):
+    """
+    Finds the lag of the autocorrelation peak of every frame.
+
+    The search starts at the first lag where the autocorrelation begins to rise again and picks the largest absolute value after it.
+
+    Args:
+        autocorrelation: A 2D array containing the non-negative lags of each frame's autocorrelation.
+
+    Returns:
+        An array with the peak lag of each frame.
+    """
+    numFrames, frameLength = autocorrelation.shape
+    if frameLength < 3:
+        return np.zeros(numFrames, dtype = np.int64)
+
+    rising = np.diff(autocorrelation[:, 1:], axis = 1) > 0
+    # The search starts one lag past the first rise, or at the last lag if the autocorrelation never rises.
+    startLags = np.where(rising.any(axis = 1), rising.argmax(axis = 1) + 2, frameLength - 1)
+
+    magnitudes = np.abs(autocorrelation)
+    magnitudes[np.arange(frameLength) < startLags[:, np.newaxis]] = -1
+    return magnitudes.argmax(axis = 1)
+
+def differenceFunction(frames, maxLag):
+    """
+    Computes the cumulative mean normalized difference function of every frame for lags up to maxLag.
+
+    Each frame's first frameLength - maxLag samples are compared with the samples each lag later, so every lag is summed over
+    the same number of samples. The correlation term comes from a single FFT the length of the frame, since no lag wraps around.
+
+    Args:
+        frames: A 2D float32 array with one frame per row.
+        maxLag: The largest lag to compute. It must be less than the frame length.
+
+    Returns:
+        A 2D float32 array containing lags 0 to maxLag of each frame's normalized difference. Frames without any difference are 1 at every lag.
+    """
+    frameLength = frames.shape[1]
+    window = frameLength - maxLag
+    fftLength = fft.next_fast_len(frameLength, True)
+    spectrum = fft.rfft(frames, fftLength, axis = 1)
+    spectrum *= np.conj(fft.rfft(frames[:, :window], fftLength, axis = 1))
+    difference = fft.irfft(spectrum, fftLength, axis = 1)[:, :maxLag + 1]
+
+    # The energy of the window starting at each lag, from a running sum of squares.
+    squares = np.zeros((len(frames), frameLength + 1), dtype = np.float32)
+    np.cumsum(np.square(frames), axis = 1, out = squares[:, 1:])
+    energy = squares[:, window:window + maxLag + 1] - squares[:, :maxLag + 1]
+
+    # The difference at each lag is the energy of both windows minus twice their correlation.
+    difference *= -2
+    difference += energy
+    difference += energy[:, :1]
+    np.maximum(difference, 0, out = difference)
+
+    normalized = np.ones_like(difference)
+    cumulative = np.cumsum(difference[:, 1:], axis = 1)
+    difference[:, 1:] *= np.arange(1, maxLag + 1, dtype = np.float32)
+    np.divide(difference[:, 1:], cumulative, out = normalized[:, 1:], where = cumulative > 0)
+    return normalized
+
+class PitchDetector:
+    """Estimates the pitch of frames of a single channel of audio."""
+
+    # The name that the detector is selected by.
+    name = None
+
+    def __init__(self, lowestFrequency, highestFrequency):
+        """
+        Initializes a pitch detector.
+
+        Args:
+            lowestFrequency: The lowest frequency that needs to be detected.
+            highestFrequency: The highest frequency that needs to be detected.
+        """
+        self.lowestFrequency = lowestFrequency
+        self.highestFrequency = highestFrequency
+
+    def detectFrequencies(self, samples, sampleRate, increment, windowLength = None, length = None):
+        """
+        Estimates the frequency of consecutive frames of a single channel.
+
+        Each frame lasts increment samples, and its pitch is estimated from a window of windowLength samples centered on it.
+        The samples start with the (windowLength - increment) // 2 samples before the first frame that its window covers.
+
+        Args:
+            samples: The samples of a single channel.
+            sampleRate: The sample rate of the samples.
+            increment: The length of each frame in samples.
+            windowLength: The length of the window analyzed for each frame in samples. Defaults to the increment.
+            length: The number of samples covered by the frames, after the samples before the first frame.
+                Defaults to every sample. Windows of the last frames are cut short where the samples end.
+
+        Returns:
+            A tuple of the frequency and the duration in samples of each frame. The last frame may be shorter than the increment.
+        """
+        if not windowLength:
+            windowLength = increment
+        if length is None:
+            length = len(samples) - (windowLength - increment) // 2
+        frameCount = -(-length // increment)
+
+        frames = frameSignal(samples, windowLength, increment)[:frameCount]
+        periods = []
+        for start in range(0, len(frames), BATCH_FRAMES):
+            periods.append(self.findPeriods(frames[start:start + BATCH_FRAMES], sampleRate))
+        for frame in range(len(frames), frameCount):
+            start = frame * increment
+            periods.append(self.findPeriods(samples[np.newaxis, start:start + windowLength], sampleRate))
+
+        if not periods:
+            return np.zeros(0), np.zeros(0, dtype = np.int64)
+
+        periods = np.concatenate(periods)
+        frequencies = np.zeros(len(periods))
+        valid = periods > 0
+        frequencies[valid] = sampleRate / periods[valid]
+        durations = np.full(frameCount, increment, dtype = np.int64)
+        durations[-1] = length - (frameCount - 1) * increment
+        return frequencies, durations
+
+    def findPeriods(self, frames, sampleRate):
+        """
+        Estimates the period of every frame.
+
+        Args:
+            frames: A 2D array with one frame per row.
+            sampleRate: The sample rate of the frames.
+
+        Returns:
+            An array with the period in samples of each frame, or 0 where no period was found.
+        """
+        raise NotImplementedError
+
+    def getParameters(self):
+        """
+        Gets the parameters that change the detected pitches.
+
+        Returns:
+            A hashable tuple of the detector's parameters.
+        """
+        return (self.name,)
+
+class AutocorrelationDetector(PitchDetector):
+    """Picks the largest autocorrelation peak after the autocorrelation starts rising, computed over all lags of each frame."""
+
+    name = "autocorrelation"
+
+    def findPeriods(self, frames, sampleRate):
+        """
+        Estimates the period of every frame from the peak of its autocorrelation.
+
+        Args:
+            frames: A 2D array with one frame per row.
+            sampleRate: The sample rate of the frames.
+
+        Returns:
+            An array with the period in samples of each frame, or 0 where no period was found.
+        """
+        # The peak lag is measured one sample past the lag of the detected period.
+        return np.maximum(findPeakLags(autocorrelate(frames)) - 1, 0)
+
+class YinDetector(PitchDetector):
+    """
+    Finds the first dip of the cumulative mean normalized difference function (YIN) below a threshold.
+
+    Only lags between the periods of the highest and lowest frequency are searched, and only lags up to the period of the
+    lowest frequency are computed, from a single FFT no longer than the frame. Choosing the first dip instead of the deepest
+    one avoids picking a multiple of the period, which would be detected an octave or more too low.
+    """
+
+    name = "yin"
+    # The normalized difference below which a dip is taken as the period.
+    THRESHOLD = 0.15
+    # The smallest fraction of a frame that differences are summed over. It limits the longest period in short frames.
+    WINDOW_FRACTION = 1 / 3
+
+    def __init__(self, lowestFrequency, highestFrequency, threshold = THRESHOLD):
+        """
+        Initializes a YIN pitch detector.
+
+        Args:
+            lowestFrequency: The lowest frequency that needs to be detected.
+            highestFrequency: The highest frequency that needs to be detected.
+            threshold: The normalized difference below which a dip is taken as the period.
+        """
+        super().__init__(lowestFrequency, highestFrequency)
+        self.threshold = threshold
+
+    def findPeriods(self, frames, sampleRate):
+        """
+        Estimates the period of every frame from the first dip of its normalized difference function.
+
+        Args:
+            frames: A 2D array with one frame per row.
+            sampleRate: The sample rate of the frames.
+
+        Returns:
+            An array with the period in samples of each frame, interpolated between lags, or 0 where no period was found.
+        """
+        numFrames, frameLength = frames.shape
+        # Lags up to maxLag are computed, so the search, which ends a lag earlier, can interpolate around every lag it finds.
+        maxLag = min(int(np.ceil(sampleRate / self.lowestFrequency)) + 1, frameLength - int(np.ceil(frameLength * YinDetector.WINDOW_FRACTION)))
+        minLag = max(int(sampleRate / self.highestFrequency), 2)
+        if maxLag <= minLag + 1:
+            return np.zeros(numFrames)
+
+        normalized = differenceFunction(np.asarray(frames, dtype = np.float32), maxLag)
+        search = normalized[:, minLag:maxLag]
+        searchLength = search.shape[1]
+
+        below = search < self.threshold
+        voiced = below.any(axis = 1)
+        # Follow the first dip below the threshold down to its local minimum.
+        firstBelow = below.argmax(axis = 1)
+        rising = (search[:, 1:] >= search[:, :-1]) & (np.arange(searchLength - 1) >= firstBelow[:, np.newaxis])
+        minima = np.where(rising.any(axis = 1), rising.argmax(axis = 1), searchLength - 1)
+        lags = minima + minLag
+
+        # Fit a parabola through the minimum and its neighbors to find the period between lags.
+        rows = np.arange(numFrames)
+        previous = normalized[rows, lags - 1]
+        current = normalized[rows, lags]
+        following = normalized[rows, lags + 1]
+        curvature = previous - 2 * current + following
+        shifts = np.zeros(numFrames)
+        np.divide(previous - following, 2 * curvature, out = shifts, where = curvature > 0)
+        periods = lags + np.clip(shifts, -0.5, 0.5)
+        return np.where(voiced, periods, 0)
+
+    def getParameters(self):
+        """
+        Gets the parameters that change the detected pitches.
+
+        Returns:
+            A hashable tuple of the detector's parameters.
+        """
+        return (self.name, self.lowestFrequency, self.highestFrequency, self.threshold)
+
+# The pitch detectors, by name.
+DETECTORS = {detector.name: detector for detector in (AutocorrelationDetector, YinDetector)}
+
+def createDetector(name, lowestFrequency, highestFrequency):
+    """
+    Creates a pitch detector by name.
+
+    Args:
+        name: The name of the detector, from DETECTORS.
+        lowestFrequency: The lowest frequency that needs to be detected.
+        highestFrequency: The highest frequency that needs to be detected.
+
+    Returns:
+        The pitch detector.
+
+    Raises:
+        ValueError: If there is no detector with the name.
+    """
+    if name not in DETECTORS:
+        raise ValueError("Unknown pitch detector {!r}, choose from: {}".format(name, ", ".join(DETECTORS)))
+    return DETECTORS[name](lowestFrequency, highestFrequency)
@@ -0,0 +1,123 @@
+import numpy as np
+
+import audioprocessor
+
+# The volume [0,1] below which notes are silenced.
+SOFT_NOTE_THRESHOLD = 0.2
+# The number of standard deviations from the mean pitch beyond which notes are silenced.
+OUTLIER_DEVIATIONS = 2
+# The smallest jump in semitones from the previous note that silences a note lasting a single frame.
+MAX_JUMP = 12
+
+def processChannelNotes(channelNotes, notePeaks, peak, increment, softNoteThreshold = SOFT_NOTE_THRESHOLD, outlierDeviations = OUTLIER_DEVIATIONS, maxJump = MAX_JUMP):
+    """
+    Cleans up the notes found by pitch detection in a single channel.
+
+    Args:
+        channelNotes: The detected notes of the channel as a NoteArray, with repeated notes merged. They are changed in place.
+        notePeaks: The peak sample magnitude of each note.
+        peak: The peak sample magnitude of the channel.
+        increment: The length of each pitch detection frame in samples.
+        softNoteThreshold: The volume [0,1] below which notes are silenced.
+        outlierDeviations: The number of standard deviations from the mean pitch beyond which notes are silenced.
+        maxJump: The smallest jump in semitones from the previous note that silences a note lasting a single frame.
+
+    Returns:
+        A tuple of the cleaned up notes, the mean and standard deviation of the notes that were played,
+        and a list with the name and the number of notes before and after each merge.
+    """
+    setVolumes(channelNotes, notePeaks, peak)
+    mergeCounts = []
+
+    # 0-out notes that are too soft.
+    silenceSoftNotes(channelNotes, softNoteThreshold)
+
+    notesBefore = len(channelNotes)
+    channelNotes.merge()
+    mergeCounts.append(("soft note", notesBefore, len(channelNotes)))
+
+    # 0 out notes that deviate too far.
+    mean, deviation = getPitchStatistics(channelNotes, increment)
+    silenceOutliers(channelNotes, mean, deviation, increment, outlierDeviations, maxJump)
+
+    notesBefore = len(channelNotes)
+    channelNotes.merge()
+    mergeCounts.append(("outlier", notesBefore, len(channelNotes)))
+
+    return channelNotes, mean, deviation, mergeCounts
+
+def setVolumes(channelNotes, notePeaks, peak):
+    """
+    Changes volumes of notes based on peaks of the original track.
+
+    Args:
+        channelNotes: The notes of a single channel as a NoteArray.
+        notePeaks: The peak sample magnitude of each note.
+        peak: The peak sample magnitude of the channel.
+    """
+    pitched = channelNotes.midi != 0
+    channelNotes.volume[pitched] = np.asarray(notePeaks)[pitched] / peak
+
+def silenceSoftNotes(channelNotes, threshold):
+    """
+    Sets notes that are too soft to silence.
+
+    Args:
+        channelNotes: The notes of a single channel as a NoteArray.
+        threshold: The volume [0,1] below which notes are silenced.
+    """
+    channelNotes.setZero((channelNotes.midi != 0) & (channelNotes.volume < threshold))
+
+def getPitchStatistics(channelNotes, increment):
+    """
+    Finds the mean and standard deviation of the pitches played, weighted by how many frames each note lasts.
+
+    Args:
+        channelNotes: The notes of a single channel as a NoteArray.
+        increment: The length of each pitch detection frame in samples.
+
+    Returns:
+        A tuple of the mean and standard deviation of the MIDI numbers played, or NaN if no notes were played.
+    """
+    weights = channelNotes.duration // increment
+    weights[~audioprocessor.AudioProcessor.isNoteInRange(channelNotes.frequency)] = 0
+    totalWeight = weights.sum()
+    if totalWeight == 0:
+        return np.nan, np.nan
+    mean = (weights * channelNotes.midi).sum() / totalWeight
+    deviation = np.sqrt((weights * (channelNotes.midi - mean) ** 2).sum() / totalWeight)
+    return mean, deviation
+
+def silenceOutliers(channelNotes, mean, deviation, increment, outlierDeviations = OUTLIER_DEVIATIONS, maxJump = MAX_JUMP):
+    """
+    Sets notes that deviate too far from the mean or jump too far from the previous note to silence.
+
+    Args:
+        channelNotes: The notes of a single channel as a NoteArray.
+        mean: The mean MIDI number played in the channel.
+        deviation: The standard deviation of the MIDI numbers played in the channel.
+        increment: The length of each pitch detection frame in samples.
+        outlierDeviations: The number of standard deviations from the mean pitch beyond which notes are silenced.
+        maxJump: The smallest jump in semitones from the previous note that silences a note lasting a single frame.
+    """
+    # Throw out notes that deviate too far from the mean.
+    outliers = np.abs(channelNotes.midi - mean) > deviation * outlierDeviations
+    channelNotes.setZero(outliers)
+
+    # Jumps depend on whether earlier notes were thrown out, so they are checked in order.
+    jumps = np.zeros(len(channelNotes), dtype = bool)
+    lastNote = None
+    for i, (midi, duration) in enumerate(zip(channelNotes.midi.tolist(), channelNotes.duration.tolist())):
+        lastDifference = 0
+        if lastNote:
+            lastDifference = abs(lastNote - midi)
+        if midi > 0 and (lastDifference > deviation * outlierDeviations or lastDifference >= maxJump) and duration == increment:
+            # Throw out notes that make too large of a jump.
+            jumps[i] = True
+            midi = 0
+        if midi > 0:
+            lastNote = midi
+        elif duration > increment:
+            # Reset last note if there is silence for a while.
+            lastNote = None
+    channelNotes.setZero(jumps)
@@ -0,0 +1,203 @@
+import threading
+
+import numpy as np
+
+import instrument
+import notearray
+
+class StreamingRenderer:
+    """
+    Synthesizes notes just in time for playback, on a thread that stays a few blocks ahead of the last read.
+
+    Slicing the renderer gives the same samples as the array returned by Instrument.matchNotes.
+    """
+
+    # The number of frames synthesized at a time.
+    BLOCK_SIZE = 4096
+    # The number of blocks to synthesize ahead of the last read.
+    BLOCKS_AHEAD = 8
+
+    def __init__(self, noteInstrument, notes, sampleRate):
+        """
+        Initializes a streaming renderer.
+
+        Args:
+            noteInstrument: The instrument to synthesize the notes with.
+            notes: The notes to synthesize, as a list with a NoteArray or a list of Note objects for each channel.
+            sampleRate: The sample rate to create audio for.
+        """
+        self.instrument = noteInstrument
+        self.sampleRate = sampleRate
+        channelNotes = [notearray.NoteArray.fromNotes(channel) for channel in notes]
+        self.channels = len(channelNotes)
+        self.length = max([int(channel.duration.sum()) for channel in channelNotes] + [0])
+
+        # The notes of each channel that make a sound, sorted by where they start.
+        self.schedules = []
+        for channelIndex in range(self.channels):
+            channels, offsets, durations, frequencies, volumes = instrument.getNoteSchedule([channelNotes[channelIndex]])
+            self.schedules.append((offsets, offsets + durations, frequencies, volumes))
+        # Rendered notes that may still be needed, by channel and index in the channel's schedule.
+        self.renderedNotes = {}
+
+        self.condition = threading.Condition()
+        # Rendered blocks of samples, covering the frames from windowStart to windowEnd.
+        self.blocks = []
+        self.windowStart = 0
+        self.windowEnd = 0
+        self.readPosition = 0
+        # The frame after the last frame that a read is waiting for.
+        self.readEnd = 0
+        # Incremented on every seek, so that blocks rendered for an old position are discarded.
+        self.generation = 0
+        self.closed = False
+        self.thread = None
+        # The exception that stopped the rendering thread, if any.
+        self.error = None
+
+    def __len__(self):
+        """
+        Gets the number of frames that the renderer produces.
+
+        Returns:
+            The number of frames.
+        """
+        return self.length
+
+    def __getitem__(self, key):
+        """
+        Gets synthesized frames, waiting for them to be rendered if necessary.
+
+        Args:
+            key: A slice of frames with a step of 1.
+
+        Returns:
+            A float32 array of the frames, with a column for each channel if there is more than one.
+        """
+        start, stop, step = key.indices(self.length)
+        stop = max(start, stop)
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target = self.renderAhead, daemon = True)
+                self.thread.start()
+            if start < self.windowStart or start > self.windowEnd:
+                self.seek(start)
+            self.readPosition = start
+            self.readEnd = stop
+            self.condition.notify_all()
+            while self.windowEnd < stop:
+                if self.error:
+                    raise self.error
+                if self.closed:
+                    # A closed renderer is silent, so a playback callback that is still reading from it does not wait forever.
+                    return np.zeros(self.getShape(stop - start), dtype = np.float32)
+                self.condition.wait()
+
+            # Blocks that end before this read will not be needed again.
+            while self.blocks and self.blocks[0][0] + len(self.blocks[0][1]) <= start:
+                blockStart, block = self.blocks.pop(0)
+                self.windowStart = blockStart + len(block)
+
+            pieces = []
+            for blockStart, block in self.blocks:
+                if blockStart >= stop:
+                    break
+                pieces.append(block[max(start - blockStart, 0):stop - blockStart])
+        if not pieces:
+            return np.zeros(self.getShape(0), dtype = np.float32)
+        return np.concatenate(pieces)
+
+    def seek(self, position):
+        """
+        Restarts rendering from a new position. The condition must be held by the caller.
+
+        Args:
+            position: The frame to render from.
+        """
+        self.generation += 1
+        self.blocks = []
+        self.windowStart = position
+        self.windowEnd = position
+        self.condition.notify_all()
+
+    def close(self):
+        """Stops the rendering thread."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def renderAhead(self):
+        """Renders blocks ahead of the read position until the renderer is closed."""
+        while True:
+            with self.condition:
+                while not self.closed and (self.windowEnd >= self.length or (self.windowEnd >= self.readEnd and self.windowEnd - self.readPosition >= self.BLOCK_SIZE * self.BLOCKS_AHEAD)):
+                    self.condition.wait()
+                if self.closed:
+                    return
+                generation = self.generation
+                blockStart = self.windowEnd
+            try:
+                block = self.renderBlock(blockStart, min(blockStart + self.BLOCK_SIZE, self.length))
+            except Exception as error:
+                with self.condition:
+                    self.error = error
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                if generation == self.generation:
+                    self.blocks.append((blockStart, block))
+                    self.windowEnd = blockStart + len(block)
+                    self.condition.notify_all()
+
+    def renderBlock(self, start, stop):
+        """
+        Synthesizes a block of frames.
+
+        Args:
+            start: The first frame of the block.
+            stop: The frame after the last frame of the block.
+
+        Returns:
+            A float32 array of the frames, with a column for each channel if there is more than one.
+        """
+        block = np.zeros(self.getShape(stop - start), dtype = np.float32)
+        for channelIndex, (offsets, ends, frequencies, volumes) in enumerate(self.schedules):
+            if self.channels > 1:
+                channelBlock = block[:, channelIndex]
+            else:
+                channelBlock = block
+
+            # Notes of a channel do not overlap, so the notes in the block are consecutive in the schedule.
+            first = np.searchsorted(ends, start, side = "right")
+            last = np.searchsorted(offsets, stop, side = "left")
+            for key in list(self.renderedNotes):
+                if key[0] == channelIndex and (key[1] < first or key[1] >= last):
+                    del self.renderedNotes[key]
+
+            for noteIndex in range(first, last):
+                key = (channelIndex, noteIndex)
+                noteSamples = self.renderedNotes.get(key)
+                offset = int(offsets[noteIndex])
+                if noteSamples is None:
+                    # Each note is filtered on its own, so rendering it alone matches the offline render.
+                    noteSamples = np.zeros(int(ends[noteIndex]) - offset, dtype = np.float32)
+                    self.instrument.renderNote(noteSamples, float(frequencies[noteIndex]), volumes[noteIndex], self.sampleRate)
+                    self.renderedNotes[key] = noteSamples
+                noteStart = max(start, offset)
+                noteStop = min(stop, int(ends[noteIndex]))
+                channelBlock[noteStart - start:noteStop - start] = noteSamples[noteStart - offset:noteStop - offset]
+        return block
+
+    def getShape(self, frames):
+        """
+        Gets the shape of an array of frames.
+
+        Args:
+            frames: The number of frames.
+
+        Returns:
+            The shape of the array.
+        """
+        if self.channels > 1:
+            return (frames, self.channels)
+        return (frames,)
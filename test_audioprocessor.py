@@ -0,0 +1,66 @@
+import numpy as np
+import soundfile as sf
+
+import audioprocessor
+import benchmark
+
+def detectNotes(filePath, streaming = False, blockSize = None, **options):
+    """
+    Detects the notes of an audio file with a processor that does not play or write anything.
+
+    Args:
+        filePath: The file path of the audio file.
+        streaming: Whether to read the file block by block.
+        blockSize: The number of frames to read at a time when streaming, or None for the default.
+        options: Other arguments to the processor.
+
+    Returns:
+        A tuple of the raw pitch tracks and the notes of each channel.
+    """
+    processor = audioprocessor.AudioProcessor(playback = False, midiPath = None, wavPath = None, cacheDirectory = None, verbose = False, **options)
+    try:
+        if blockSize:
+            processor.loadAudioFile(filePath, streaming = True)
+            notes = processor.detectPitchesStreaming(filePath, blockSize)
+        else:
+            processor.loadAudioFile(filePath, streaming)
+            notes = processor.notes
+        return processor.rawTracks, notes
+    finally:
+        processor.close()
+
+def assertSameNotes(expected, actual):
+    """
+    Checks that two detections found the same raw pitch tracks and notes.
+
+    Args:
+        expected: The raw pitch tracks and notes of the reference detection.
+        actual: The raw pitch tracks and notes to check.
+    """
+    (expectedTracks, expectedNotes), (actualTracks, actualNotes) = expected, actual
+    assert len(expectedNotes) == len(actualNotes)
+    for (expectedRaw, expectedPeaks, expectedPeak), (actualRaw, actualPeaks, actualPeak) in zip(expectedTracks, actualTracks):
+        for name in ("midi", "duration", "volume"):
+            assert np.array_equal(getattr(expectedRaw, name), getattr(actualRaw, name)), name
+        assert np.array_equal(expectedPeaks, actualPeaks)
+        assert expectedPeak == actualPeak
+    for expectedChannel, actualChannel in zip(expectedNotes, actualNotes):
+        for name in ("midi", "duration", "volume"):
+            assert np.array_equal(getattr(expectedChannel, name), getattr(actualChannel, name)), name
+
+def test_detection_modes_match_in_memory(tmp_path, monkeypatch):
+    """Streaming, memory-mapped and parallel detection find the same notes as detecting the file loaded into memory."""
+    sampleRate = 22050
+    filePath = str(tmp_path / "notes.wav")
+    sf.write(filePath, benchmark.createNoteSequence(sampleRate, 20, 2), sampleRate, subtype = "FLOAT")
+    # Short segments, so notes spanning segment boundaries have to be stitched together.
+    monkeypatch.setattr(audioprocessor.AudioProcessor, "SEGMENT_FRAMES", 16)
+
+    # Windows as long as a hop, and windows that reach into the frames around them.
+    for windowDuration in (audioprocessor.AudioProcessor.WINDOW_DURATION, audioprocessor.AudioProcessor.HOP_DURATION * 2.5):
+        expected = detectNotes(filePath, memoryMap = False, windowDuration = windowDuration)
+        assert len(expected[1][0]) > 1
+        assertSameNotes(expected, detectNotes(filePath, windowDuration = windowDuration))
+        assertSameNotes(expected, detectNotes(filePath, memoryMap = False, workers = 2, windowDuration = windowDuration))
+        assertSameNotes(expected, detectNotes(filePath, streaming = True, windowDuration = windowDuration))
+        assertSameNotes(expected, detectNotes(filePath, blockSize = 1000, windowDuration = windowDuration))
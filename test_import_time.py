@@ -0,0 +1,7 @@
+import benchmark
+
+def test_import_time():
+    """Importing the audio processor stays within its time budget without loading optional dependencies."""
+    importTime, eagerModules = benchmark.measureImportTime()
+    assert not eagerModules, "Imported eagerly: " + ", ".join(eagerModules)
+    assert importTime <= benchmark.IMPORT_TIME_BUDGET
@@ -0,0 +1,93 @@
+import queue
+
+import numpy as np
+
+import instrument
+import notearray
+import notecache
+
+SAMPLE_RATE = 22050
+
+def getQueueStringSound(excitation, delaySize, duration):
+    """
+    Plucks a string with the original sample by sample Karplus-Strong implementation, which used a queue as the delay line.
+
+    Args:
+        excitation: The white noise that the string buffer starts with.
+        delaySize: The delay size of the guitar, as a percentage of the string buffer length.
+        duration: The duration of the note in samples.
+
+    Returns:
+        A float32 array of samples representing the note.
+    """
+    buffer = excitation.copy()
+    bufferLength = len(buffer)
+    scaledDelaySize = int(delaySize * bufferLength / 100)
+    delayLine = queue.Queue(maxsize = scaledDelaySize)
+    bufferCounter = 0
+    samples = []
+    for i in range(duration):
+        current = buffer[bufferCounter]
+        if delayLine.full():
+            delayed = delayLine.get()
+            next = delayLine.queue[0]
+            average = (delayed + next) / 2 * 0.999
+            current += average
+            current /= 2
+        samples.append(current)
+        delayLine.put(current)
+        buffer[bufferCounter] = current
+        bufferCounter = (bufferCounter + 1) % bufferLength
+    return np.array(samples, dtype = np.float32)
+
+def getTestNotes(channels):
+    """
+    Gets a few seconds of notes with pauses and varying volumes.
+
+    Args:
+        channels: The number of channels.
+
+    Returns:
+        A list with a NoteArray of the notes of each channel.
+    """
+    random = np.random.RandomState(0)
+    notes = []
+    for channel in range(channels):
+        count = 40
+        midi = random.randint(40, 85, count)
+        midi[random.rand(count) < 0.15] = 0
+        notes.append(notearray.NoteArray(midi, random.randint(SAMPLE_RATE // 20, SAMPLE_RATE // 4, count), random.uniform(0.3, 1, count)))
+    return notes
+
+def test_string_sound_matches_queue_implementation():
+    """The block-wise Karplus-Strong guitar gives the same samples as the queue-based one for the same excitation."""
+    guitar = instrument.AcousticGuitar()
+    for delaySize in (0, 50, 100, 200, 300, 450):
+        for frequency in (82.41, 110, 261.63, 440, 1046.5):
+            bufferLength = int(SAMPLE_RATE / frequency)
+            if int(delaySize * bufferLength / 100) == 1:
+                # The queue-based implementation cannot read the next sample of a delay line holding a single sample.
+                continue
+            guitar.delaySize = delaySize
+            excitation = np.random.RandomState(1).standard_normal(bufferLength)
+            samples = guitar.getBaseStringSound(frequency, 3000, SAMPLE_RATE, np.random.RandomState(1))
+            assert np.array_equal(samples, getQueueStringSound(excitation, delaySize, 3000)), (delaySize, frequency)
+
+def test_parallel_rendering_matches_serial():
+    """Rendering notes on a process pool gives the same samples as rendering them in the current process."""
+    for channels in (1, 2):
+        notes = getTestNotes(channels)
+        for noteInstrument in (instrument.Beep(), instrument.ElectricGuitar(), instrument.Trumpet()):
+            # Guitar notes are only reproducible when seeded. Nothing is kept in the cache, so every note is rendered again.
+            noteInstrument.noteCache = notecache.NoteCache(0, seeded = True)
+            serial = noteInstrument.matchNotes(notes, SAMPLE_RATE)
+            parallel = noteInstrument.matchNotes(notes, SAMPLE_RATE, workers = 2)
+            assert np.array_equal(serial, parallel), (type(noteInstrument).__name__, channels)
+
+def test_rendered_blocks_match_output():
+    """The blocks passed on while notes are rendered add up to the rendered output."""
+    notes = getTestNotes(2)
+    for workers in (1, 2):
+        blocks = []
+        samples = instrument.Trumpet().matchNotes(notes, SAMPLE_RATE, workers, rendered = blocks.append)
+        assert np.array_equal(np.concatenate(blocks), samples)
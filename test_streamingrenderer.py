@@ -0,0 +1,22 @@
+import numpy as np
+
+import instrument
+import streamingrenderer
+import test_instrument
+
+def test_streaming_matches_offline_render():
+    """Slicing a streaming renderer gives the same samples as rendering all notes at once, whatever the reads look like."""
+    for channels in (1, 2):
+        notes = test_instrument.getTestNotes(channels)
+        noteInstrument = instrument.Trumpet()
+        expected = noteInstrument.matchNotes(notes, test_instrument.SAMPLE_RATE)
+        renderer = streamingrenderer.StreamingRenderer(noteInstrument, notes, test_instrument.SAMPLE_RATE)
+        try:
+            assert len(renderer) == len(expected)
+            # Reads of odd sizes, a read longer than the render-ahead window and a seek backwards.
+            pieces = [renderer[start:start + 1000] for start in range(0, 30000, 1000)]
+            pieces.append(renderer[30000:30000 + streamingrenderer.StreamingRenderer.BLOCK_SIZE * streamingrenderer.StreamingRenderer.BLOCKS_AHEAD * 2])
+            assert np.array_equal(np.concatenate(pieces), expected[:len(np.concatenate(pieces))])
+            assert np.array_equal(renderer[5000:len(renderer)], expected[5000:])
+        finally:
+            renderer.close()
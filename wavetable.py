@@ -0,0 +1,47 @@
+import numpy as np
+
+# The number of samples in a single cycle of a wavetable.
+TABLE_SIZE = 4096
+
+class Wavetable:
+    """A single cycle of a periodic waveform made of harmonics, rendered by table lookup."""
+
+    def __init__(self, harmonics, size = TABLE_SIZE):
+        """
+        Initializes a wavetable.
+
+        Args:
+            harmonics: The amplitude of each harmonic, starting from the fundamental.
+            size: The number of samples in the cycle.
+        """
+        self.size = size
+        # The first sample is repeated at the end so interpolation never has to wrap around.
+        phases = np.arange(size + 1) / size
+        self.table = np.zeros(size + 1)
+        for i, amplitude in enumerate(harmonics):
+            self.table += amplitude * np.sin((i + 1) * 2 * np.pi * phases)
+        self.table[size] = self.table[0]
+
+        # Linear interpolation of a sine of k cycles per table is off by at most (pi * k / size) ^ 2 / 2 of its amplitude.
+        self.maxError = sum(abs(amplitude) * (np.pi * (i + 1) / size) ** 2 / 2 for i, amplitude in enumerate(harmonics))
+
+    def render(self, cyclesPerSample, length):
+        """
+        Renders the waveform with a phase accumulator, starting at phase 0.
+
+        The samples are within maxError of evaluating the harmonics directly.
+
+        Args:
+            cyclesPerSample: The number of cycles of the waveform the phase advances by each sample.
+            length: The number of samples to render.
+
+        Returns:
+            An array of samples of the waveform.
+        """
+        position = np.arange(length) * cyclesPerSample
+        position -= np.floor(position)
+        position *= self.size
+        index = position.astype(np.intp)
+        position -= index
+        lower = self.table[index]
+        return lower + position * (self.table[index + 1] - lower)